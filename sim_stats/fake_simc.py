@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import time
+
+# Stand in for the simc binary, for testing and benchmarking stat_sim.py without hours of real sims.
+# Takes the same profile files and options stat_sim.py uses (dps_plot_*, reforge_plot_output_file, json2, html, gear_*, profilesets,
+# iterations, target_error, deterministic, seed) and answers from a synthetic DPS model. Point simc at it with a wrapper script, e.g.
+#   #!/bin/sh
+#   exec python3 /path/to/fake_simc.py "$@"
+# Environment variables:
+#   FAKE_SIMC_NOISE    standard deviation of one iteration's DPS as a fraction of DPS, default 0.1
+#   FAKE_SIMC_LATENCY  seconds of sleep per 1000 iterations on one thread, default 0
+#   FAKE_SIMC_STARTUP  seconds of sleep every time the process starts, like simc parsing data and building the actor, default 0
+#   FAKE_SIMC_SEED     makes every run repeatable, the same options and seed always give the same DPS. Unset, runs are random like simc
+
+noise = float(os.environ.get("FAKE_SIMC_NOISE", "0.1"))
+latency = float(os.environ.get("FAKE_SIMC_LATENCY", "0"))
+startup = float(os.environ.get("FAKE_SIMC_STARTUP", "0"))
+fixed_seed = os.environ.get("FAKE_SIMC_SEED", "")
+version = "SimulationCraft 1105-01 (fake) for World of Warcraft 11.0.5.57171 Live (hotfix 2024-11-01/57171, git build fake)"
+# Correlation between runs that share a seed, how much of the noise common random numbers cancel
+crn_correlation = 0.9
+primary_stats = ['strength', 'agility', 'intellect']
+# Options that only say where to write results or how fast to run, they dont change the numbers
+output_options = ('reforge_plot_output_file', 'json2', 'html', 'threads', 'profileset_main_threads', 'profileset_work_threads')
+
+def parse_line( line, options, profilesets ):
+    line = line.strip()
+    if( line == "" or line.startswith("#") or "=" not in line ):
+        return
+    key, value = line.split("=", 1)
+    if( key.startswith("profileset.") and key.endswith("+") ):
+        name = key[len("profileset."):-1].strip('"')
+        profilesets.setdefault(name, []).append(value)
+        return
+    options[key] = value
+
+# Diminishing returns past 30%, like secondary stats in game
+def stat_pct( rating, per_pct ):
+    pct = rating / per_pct
+    if( pct < 30 ):
+        return pct
+    return 30 + ( pct - 30 ) * 0.8
+
+def true_dps( options ):
+    haste = float(options.get("gear_haste_rating", 0) or 0)
+    crit = float(options.get("gear_crit_rating", 0) or 0)
+    mastery = float(options.get("gear_mastery_rating", 0) or 0)
+    vers = float(options.get("gear_versatility_rating", 0) or 0)
+    primary = sum(float(options.get(f"gear_{p}", 0) or 0) for p in primary_stats)
+    haste_pct = stat_pct(haste, 660)
+    # Small breakpoints every 5% haste, the kind of detail a sweep should find
+    haste_pct += 0.5 * math.floor(haste_pct / 5)
+    dps = 100000 * ( 1 + primary / 20000 )
+    dps *= 1 + haste_pct / 100
+    dps *= 1 + 0.8 * stat_pct(crit, 700) / 100
+    dps *= 1 + 0.9 * stat_pct(mastery, 720) / 100
+    dps *= 1 + stat_pct(vers, 780) / 100
+    dps *= 1 + 0.02 * ( int(options.get("desired_targets", 1)) - 1 )
+    # The opener is worth relatively more in a short fight
+    dps *= 1 + 15 / max(1.0, float(options.get("max_time", 300)))
+    return dps
+
+def threads( options ):
+    return max(1, int(options.get("threads", 1) or 1))
+
+# Iterations it takes to reach target_error, capped at iterations like simc
+def iterations_run( options, iterations ):
+    target_error = float(options.get("target_error", 0))
+    if( target_error > 0 ):
+        needed = math.ceil(( 1.96 * noise / ( target_error / 100 ) ) ** 2)
+        iterations = max(2, min(iterations, needed))
+    return iterations
+
+def run_point( options, iterations, rng, shared_z ):
+    dps = true_dps(options)
+    iterations = iterations_run(options, iterations)
+    sd = dps * noise / math.sqrt(iterations)
+    if( shared_z is None ):
+        z = rng.gauss(0, 1)
+    else:
+        z = crn_correlation * shared_z + math.sqrt(1 - crn_correlation ** 2) * rng.gauss(0, 1)
+    if( latency > 0 ):
+        time.sleep(latency * iterations / 1000 / threads(options))
+    return dps + z * sd, 1.96 * sd, iterations
+
+def make_rng( options, profilesets ):
+    if( fixed_seed == "" ):
+        return random.Random()
+    key = json.dumps([fixed_seed, sorted((k, v) for k, v in options.items() if k not in output_options), sorted(profilesets.items())])
+    return random.Random(hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+def reforge_plot( options, rng, shared_z ):
+    plot_stat = options["dps_plot_stat"]
+    points = int(options.get("dps_plot_points", 1))
+    step = int(options.get("dps_plot_step", 0))
+    iterations = int(options.get("dps_plot_iterations", options.get("iterations", 1000)))
+    start = 0 if options.get("dps_plot_positive", "0") == "1" else -points
+    stat_name = plot_stat if plot_stat in primary_stats else f"{plot_stat}_rating"
+    rows = []
+    for i in range(start, points + 1):
+        point_options = dict(options)
+        point_options[f"gear_{stat_name}"] = float(options.get(f"gear_{stat_name}", 0) or 0) + i * step
+        dps, error, _ = run_point(point_options, iterations, rng, shared_z)
+        rows.append(f"{i * step}, {dps:.6f}, {error:.6f}")
+    output = options.get("reforge_plot_output_file", "")
+    if( output != "" ):
+        with open(output, "w") as f:
+            f.write(f"{options.get('name', 'fake')} Reforge Plot Results:\n")
+            f.write(f"{stat_name}, DPS, DPS-Error\n")
+            f.write("\n".join(rows) + "\n")
+
+# The parts of simc's json2 report stat_sim.py reads
+def json_report( options, profilesets, rng, shared_z ):
+    iterations = int(options.get("iterations", 1000))
+    dps, error, count = run_point(options, iterations, rng, shared_z)
+    print(f"DPS={dps:.1f} DPS-Error={error:.1f}")
+    report = {
+        "version": "1105-01",
+        "sim": {
+            "options": {"confidence_estimator": 1.96, "iterations": count},
+            "players": [{"name": options.get("name", "fake"), "collected_data": {"dps": {"mean": dps, "mean_std_dev": error / 1.96, "count": count}}}],
+        }
+    }
+    results = []
+    for name, mods in profilesets.items():
+        set_options = dict(options)
+        for m in mods:
+            parse_line(m, set_options, {})
+        set_dps, set_error, set_count = run_point(set_options, iterations, rng, shared_z)
+        results.append({"name": name, "mean": set_dps, "mean_error": set_error, "mean_stddev": set_error / 1.96, "iterations": set_count})
+    if( len(results) > 0 ):
+        report["sim"]["profilesets"] = {"metric": "Damage per Second", "results": results}
+    return report
+
+def main( argv ):
+    if( len(argv) == 0 ):
+        print(version)
+        return 0
+    options = {}
+    profilesets = {}
+    for arg in argv:
+        if( "=" not in arg ):
+            if( not os.path.isfile(arg) ):
+                print(f"Unable to open input file '{arg}'", file=sys.stderr)
+                return 1
+            with open(arg, "r") as f:
+                for line in f:
+                    parse_line(line, options, profilesets)
+        else:
+            parse_line(arg, options, profilesets)
+    print(version)
+    if( startup > 0 ):
+        time.sleep(startup)
+    rng = make_rng(options, profilesets)
+    shared_z = None
+    seed = options.get("seed", "")
+    if( seed != "" and options.get("deterministic", "0") == "1" ):
+        shared_z = random.Random(int(seed)).gauss(0, 1)
+        if( fixed_seed == "" ):
+            rng = random.Random(int(seed))
+            rng.gauss(0, 1)
+    if( options.get("dps_plot_stat", "") != "" ):
+        reforge_plot(options, rng, shared_z)
+    else:
+        report = json_report(options, profilesets, rng, shared_z)
+        if( options.get("json2", "") != "" ):
+            with open(options["json2"], "w") as f:
+                json.dump(report, f)
+    if( options.get("html", "") != "" ):
+        with open(options["html"], "w") as f:
+            f.write("<html><body>fake simc report</body></html>\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,231 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Benchmarks the parts of stat_sim.py that are not simc, using fake_simc.py in place of the real binary.
+#   python sim_bench.py                      full size run, prints a table and writes bench_results.json
+#   python sim_bench.py --quick              smaller sweeps, for a check in a minute or two
+#   python sim_bench.py --compare old.json   flags every case that got slower than old.json by more than --tolerance
+# Linux and macOS only, the fake simc is started through a shell wrapper.
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, script_dir)
+
+# Stat and matrix sweep sizes, the full ones match a default stat_sim.py run
+sizes = {
+    'full': {'jobs': 48, 'job_seconds': 0.25, 'plot_points': 1000, 'matrix_points': 100, 'matrix_secondary_points': 5, 'chart_points': 1000, 'charts': 5},
+    'quick': {'jobs': 12, 'job_seconds': 0.1, 'plot_points': 200, 'matrix_points': 20, 'matrix_secondary_points': 5, 'chart_points': 200, 'charts': 3},
+}
+
+# A copy of sim_stats with simc replaced by fake_simc.py, so runs never touch the real results store, cache or outputs
+def make_sandbox( root ):
+    sandbox = os.path.join(root, "sim_stats")
+    os.makedirs(sandbox)
+    for path in glob.glob(os.path.join(script_dir, "*.py")):
+        shutil.copy(path, sandbox)
+    for folder in ("profiles", "raw_data", "data_output", "chart_output"):
+        os.makedirs(os.path.join(sandbox, folder))
+    with open(os.path.join(sandbox, "profiles", "bench.simc"), "w") as f:
+        f.write('deathknight="bench"\nspec=unholy\nlevel=80\n')
+    os.makedirs(os.path.join(root, "simc"))
+    simc = os.path.join(root, "simc", "simc")
+    with open(simc, "w") as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(script_dir, "fake_simc.py")}" "$@"\n')
+    os.chmod(simc, 0o755)
+    return sandbox, simc
+
+def bench_env( latency ):
+    return dict(os.environ, FAKE_SIMC_SEED="bench", FAKE_SIMC_LATENCY=str(latency))
+
+# Runs function with stdout pointed at /dev/null, including the output of any process it starts
+def silenced( function ):
+    sys.stdout.flush()
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        return function()
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+        os.close(devnull)
+
+def timed( function ):
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    result = function()
+    return time.perf_counter() - start_wall, time.process_time() - start_cpu, result
+
+# Same number of equally long fake sims through each scheduling strategy, efficiency is the ideal wall time over the measured one
+def bench_job_engine( size, root, simc, results ):
+    from sim_jobs import run_jobs
+    from sim_queue import run_queue_jobs, start_local_workers, stop_local_workers
+    cores = os.cpu_count() or 1
+    iterations = 1000
+    latency = size['job_seconds']
+    os.environ.update(bench_env(latency))
+    def make_jobs( name ):
+        jobs = []
+        for i in range(size['jobs']):
+            output = os.path.join(root, f"{name}_{i}.json")
+            jobs.append({'kind': 'gear', 'id': f"{name}/{i}", 'command': [simc, f"iterations={iterations}", f"gear_haste_rating={i * 100}", f"json2={output}", "threads=1"], 'output': output})
+        return jobs
+    finished = []
+    on_finished = lambda job, return_code: finished.append(return_code)
+    strategies = [(f"local x{c}", c) for c in sorted(set([1, 2, cores, cores * 2]))]
+    for name, concurrent in strategies:
+        wall, cpu, _ = timed(lambda: silenced(lambda: run_jobs(make_jobs("local"), concurrent, on_finished)))
+        ideal = size['jobs'] * latency / min(concurrent, cores)
+        add_result(results, "job engine", name, wall, cpu, {'jobs': size['jobs'], 'efficiency': ideal / wall})
+    queue_dir = os.path.join(root, "queue")
+    workers = start_local_workers(queue_dir, cores, simc, 1)
+    try:
+        wall, cpu, _ = timed(lambda: silenced(lambda: run_queue_jobs(make_jobs("queue"), queue_dir, on_finished, poll_seconds=0.2)))
+    finally:
+        stop_local_workers(workers)
+    add_result(results, "job engine", f"queue x{cores}", wall, cpu, {'jobs': size['jobs'], 'efficiency': size['jobs'] * latency / cores / wall})
+    failed = sum(1 for r in finished if r != 0)
+    if( failed > 0 ):
+        print(f"{failed} fake sims failed")
+
+def run_stat_sim( sandbox, options, env ):
+    options_path = os.path.join(sandbox, "bench_options.json")
+    with open(options_path, "w") as f:
+        json.dump(options, f)
+    env = dict(env, STAT_SIM_OPTIONS=options_path)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, os.path.join(sandbox, "stat_sim.py")], cwd=sandbox, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if( result.returncode != 0 ):
+        print(result.stderr)
+        sys.exit(f"stat_sim.py failed with options {options}")
+    return time.perf_counter() - start
+
+# Whole stat_sim.py runs with sims that take no time: the first run is orchestration, csv handling, derived data and charts,
+# the second hits the cache for every sim so it is only the derived data pipeline and charts
+def bench_pipeline( size, root, results ):
+    sandbox, simc = make_sandbox(os.path.join(root, "pipeline"))
+    base = {'input_profile': "bench.simc", 'graph_open': False, 'max_concurrent_sims': os.cpu_count() or 1, 'modify_current_stats': True}
+    cases = [
+        ("stat sweep", {'sim_haste': True, 'sim_crit': True, 'sim_mastery': True, 'sim_vers': True, 'sim_primary': True, 'plot_points': size['plot_points']}),
+        ("matrix sweep", {'sim_haste_matrix': True, 'gen_crit_secondary_matrix': True, 'gen_mastery_secondary_matrix': True, 'gen_vers_secondary_matrix': True, 'gen_primary_secondary_matrix': True,
+                          'matrix_points': size['matrix_points'], 'matrix_secondary_points': size['matrix_secondary_points']}),
+    ]
+    for name, options in cases:
+        options = dict(base, **options)
+        cold = run_stat_sim(sandbox, dict(options, resume_sweeps=False), bench_env(0))
+        add_result(results, "pipeline", f"{name} cold", cold, None, {})
+        warm = run_stat_sim(sandbox, dict(options, resume_sweeps=False), bench_env(0))
+        add_result(results, "pipeline", f"{name} cached", warm, None, {})
+
+# In process timings of the derived data steps at full sweep size
+def bench_data( size, root, results ):
+    import numpy as np
+    import pandas as pd
+    import io
+    from sim_smoothing import local_linear
+    from sim_store import open_store, store_points, query_sweep
+    points = size['plot_points']
+    x = np.arange(points + 1) * 50.0
+    dps = 100000 + 2 * x + np.random.default_rng(1).normal(0, 300, len(x))
+    error = np.full(len(x), 600.0)
+    text = "bench Reforge Plot Results:\nhaste_rating, DPS, DPS-Error\n" + "\n".join(f"{a}, {b}, {c}" for a, b, c in zip(x, dps, error)) + "\n"
+    wall, cpu, _ = timed(lambda: [pd.read_csv(io.StringIO(text), skiprows=1) for i in range(5)])
+    add_result(results, "data", f"parse 5 x {points} point csv", wall, cpu, {})
+    series = [(x, dps, error)] * 5
+    wall, cpu, _ = timed(lambda: local_linear(series, 900))
+    add_result(results, "data", f"smooth 5 x {points} points", wall, cpu, {})
+    matrix_series = [(x[:size['matrix_secondary_points'] + 1], dps[:size['matrix_secondary_points'] + 1], error[:size['matrix_secondary_points'] + 1])] * size['matrix_points'] * 4
+    wall, cpu, _ = timed(lambda: local_linear(matrix_series, float('inf')))
+    add_result(results, "data", f"fit {len(matrix_series)} matrix points", wall, cpu, {})
+    store = open_store(os.path.join(root, "bench.sqlite"))
+    def store_and_query():
+        for i in range(size['matrix_points']):
+            store_points(store, "bench", "bench", "bench", "haste", "crit", i * 500.0, "bench", x, dps, error)
+        return query_sweep(store, "bench", "bench", "bench", "haste", "crit")
+    wall, cpu, _ = timed(store_and_query)
+    add_result(results, "data", f"store and query {size['matrix_points']} matrix points", wall, cpu, {})
+
+# The first image export starts kaleido, every later one reuses it. A batch export skips charts that did not change since the last one
+def bench_charts( size, root, results ):
+    import plotly.graph_objects as go
+    x = list(range(0, size['chart_points'] * 50, 50))
+    fig = go.Figure()
+    for i in range(5):
+        fig.add_trace(go.Scatter(x=x, y=[v * 0.01 + i for v in x], mode="lines+markers"))
+    fig.update_layout(width=2000, height=1000)
+    wall, cpu, _ = timed(lambda: fig.write_image(os.path.join(root, "chart_first.png")))
+    add_result(results, "charts", "first png export", wall, cpu, {})
+    def later_exports():
+        for i in range(size['charts']):
+            fig.write_image(os.path.join(root, f"chart_{i}.png"))
+    wall, cpu, _ = timed(later_exports)
+    add_result(results, "charts", f"{size['charts']} more png exports", wall, cpu, {})
+    from sim_charts import export_charts
+    charts = []
+    for i in range(size['charts']):
+        fig.update_layout(title=f"chart {i}")
+        charts.append({'path': os.path.join(root, "batch", f"chart_{i}"), 'figure': fig.to_json(), 'formats': ["png"]})
+    wall, cpu, _ = timed(lambda: export_charts(charts))
+    add_result(results, "charts", f"{size['charts']} png batch export", wall, cpu, {})
+    wall, cpu, _ = timed(lambda: export_charts(charts))
+    add_result(results, "charts", f"{size['charts']} png batch export unchanged", wall, cpu, {})
+
+def add_result( results, group, name, wall, cpu, extra ):
+    results.append(dict({'group': group, 'case': name, 'wall': wall, 'cpu': cpu}, **extra))
+    cpu_text = "" if cpu is None else f"{cpu:9.2f}s cpu"
+    extra_text = "  ".join(f"{k} {v:.2f}" if isinstance(v, float) else f"{k} {v}" for k, v in extra.items())
+    print(f"{group:12} {name:40} {wall:9.2f}s wall {cpu_text:14} {extra_text}")
+
+# Cases that got slower than the baseline by more than tolerance, as a fraction
+def compare_results( results, baseline, tolerance ):
+    old = {(r['group'], r['case']): r for r in baseline['results']}
+    slower = []
+    for r in results:
+        before = old.get((r['group'], r['case']))
+        if( before is not None and r['wall'] > before['wall'] * ( 1 + tolerance ) ):
+            slower.append(f"{r['group']} / {r['case']}: {before['wall']:.2f}s -> {r['wall']:.2f}s")
+    return slower
+
+parser = argparse.ArgumentParser(description="Benchmarks stat_sim.py orchestration with a fake simc")
+parser.add_argument("--quick", action="store_true", help="Smaller sweeps")
+parser.add_argument("--only", default="jobs,pipeline,data,charts", help="Comma separated groups to run: jobs, pipeline, data, charts")
+parser.add_argument("--output", default=os.path.join(script_dir, "bench_results.json"), help="Where to write the results")
+parser.add_argument("--compare", default=None, help="Results file of an earlier run to compare against")
+parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against --compare before a case counts as a regression")
+args = parser.parse_args()
+
+size = sizes['quick' if args.quick else 'full']
+groups = args.only.split(",")
+results = []
+root = tempfile.mkdtemp(prefix="sim_bench_")
+try:
+    if( "jobs" in groups ):
+        sandbox, simc = make_sandbox(os.path.join(root, "jobs"))
+        bench_job_engine(size, root, simc, results)
+    if( "pipeline" in groups ):
+        bench_pipeline(size, root, results)
+    if( "data" in groups ):
+        bench_data(size, root, results)
+    if( "charts" in groups ):
+        bench_charts(size, root, results)
+finally:
+    shutil.rmtree(root, ignore_errors=True)
+
+with open(args.output, "w") as f:
+    json.dump({'size': 'quick' if args.quick else 'full', 'cores': os.cpu_count(), 'time': time.time(), 'results': results}, f, indent=4)
+print(f"Results written to {args.output}")
+
+if( args.compare is not None ):
+    with open(args.compare, "r") as f:
+        slower = compare_results(results, json.load(f), args.tolerance)
+    for line in slower:
+        print(f"Slower: {line}")
+    if( len(slower) > 0 ):
+        sys.exit(1)
@@ -0,0 +1,71 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+# Profile options that only change where simc writes its reports or how fast it runs, not the result
+ignored_profile_options = ('html=', 'json2=', 'report_details=', 'threads=')
+
+def profile_fingerprint( profile_text ):
+    lines = [line.strip() for line in profile_text.splitlines()]
+    return "\n".join(line for line in lines if line != "" and not line.startswith(ignored_profile_options))
+
+# The key covers the fully generated profile, the sim options, the stat and rating point and the simc build, so any change to them is a miss
+def cache_key( profile_text, options, version ):
+    key_data = json.dumps({'profile': profile_fingerprint(profile_text), 'options': options, 'simc': version}, sort_keys=True)
+    return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+def cache_path( cache_dir, key ):
+    return os.path.join(cache_dir, key[:2], key + ".csv")
+
+def cache_get( cache_dir, key ):
+    path = cache_path(cache_dir, key)
+    try:
+        with open(path, "r") as f:
+            text = f.read()
+    except FileNotFoundError:
+        return None
+    # Bump the modification time so eviction drops the least recently used entries first.
+    # Another process may have evicted the entry since it was read, then it counts as a miss
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return text
+
+def cache_put( cache_dir, key, text ):
+    path = cache_path(cache_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Every writer gets its own temporary file, processes sharing the cache may write the same key at once
+    handle, temp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+    with os.fdopen(handle, "w") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+# Removes entries older than max_age_days, then the least recently used ones until the cache is under max_size_mb
+def cache_evict( cache_dir, max_age_days, max_size_mb ):
+    if( not os.path.isdir(cache_dir) ):
+        return
+    entries = []
+    for root, dirs, files in os.walk(cache_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+    oldest_allowed = time.time() - max_age_days * 86400
+    # Temporary files are only removed once they are too old to still be written, another process evicting may remove any entry first
+    entries = [e for e in entries if not e[2].endswith(".tmp") or e[0] < oldest_allowed]
+    total_size = sum(e[1] for e in entries)
+    for mtime, size, path in entries:
+        if( mtime >= oldest_allowed and total_size <= max_size_mb * 1024 * 1024 ):
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
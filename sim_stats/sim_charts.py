@@ -0,0 +1,133 @@
+import concurrent.futures
+import hashlib
+import json
+import os
+import numpy as np
+
+# Chart export in batches. A chart is {'path': output path without extension, 'figure': the figure as plotly json text, 'formats': ["png", "svg", "html"]}.
+# Images go through plotly's kaleido renderer, which starts once per process and is reused for every chart after it, so a batch
+# pays the renderer startup once instead of once per chart. Charts whose figure did not change since they were last written are skipped,
+# the hash of every written file is kept in chart_hashes.json next to it.
+
+hash_file_name = "chart_hashes.json"
+
+def chart_hash( chart, chart_format ):
+    return hashlib.sha256(f"{chart_format}\n{chart['figure']}".encode("utf-8")).hexdigest()
+
+def load_hashes( directory ):
+    path = os.path.join(directory, hash_file_name)
+    if( not os.path.isfile(path) ):
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+# Replaced in one go, several stat_sim.py processes of a campaign can write charts into the same directory
+def save_hashes( directory, hashes ):
+    path = os.path.join(directory, hash_file_name)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(hashes, f, indent=4)
+    os.replace(temp_path, path)
+
+def render_chart( figure_json, chart_format, path ):
+    import plotly.io as pio
+    figure = json.loads(figure_json)
+    if( chart_format == "html" ):
+        # Standalone, plotly.js is embedded so the file opens without a network connection
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(pio.to_html(figure, include_plotlyjs=True, full_html=True, validate=False))
+        return
+    with open(path, "wb") as f:
+        f.write(pio.to_image(figure, format=chart_format, validate=False))
+
+# Every (chart, format) whose file is missing or was written from another figure
+def changed_charts( charts ):
+    todo = []
+    hashes = {}
+    for chart in charts:
+        directory = os.path.dirname(chart['path'])
+        if( directory not in hashes ):
+            hashes[directory] = load_hashes(directory)
+        for chart_format in chart['formats']:
+            path = f"{chart['path']}.{chart_format}"
+            digest = chart_hash(chart, chart_format)
+            if( hashes[directory].get(os.path.basename(path)) == digest and os.path.isfile(path) ):
+                continue
+            todo.append((chart, chart_format, path, digest))
+    return todo, hashes
+
+# Renders a batch of charts, processes above 1 spreads them over a pool of processes that each keep their own renderer.
+# Returns how many files were written and how many were skipped as unchanged
+def export_charts( charts, processes=1 ):
+    todo, hashes = changed_charts(charts)
+    skipped = sum(len(c['formats']) for c in charts) - len(todo)
+    for chart, chart_format, path, digest in todo:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    if( processes > 1 and len(todo) > 1 ):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(processes, len(todo))) as pool:
+            renders = [pool.submit(render_chart, chart['figure'], chart_format, path) for chart, chart_format, path, digest in todo]
+            for render in renders:
+                render.result()
+    else:
+        for chart, chart_format, path, digest in todo:
+            render_chart(chart['figure'], chart_format, path)
+    for chart, chart_format, path, digest in todo:
+        hashes[os.path.dirname(path)][os.path.basename(path)] = digest
+    for directory in set(os.path.dirname(path) for chart, chart_format, path, digest in todo):
+        save_hashes(directory, hashes[directory])
+    return len(todo), skipped
+
+# A batch file holds one chart per line, stat_sim.py writes one instead of rendering when a campaign renders every spec's charts together
+def write_batch_file( path, charts ):
+    with open(path, "a") as f:
+        for chart in charts:
+            f.write(json.dumps(chart) + "\n")
+
+def read_batch_files( paths ):
+    charts = []
+    for path in paths:
+        if( not os.path.isfile(path) ):
+            continue
+        with open(path, "r") as f:
+            charts += [json.loads(line) for line in f if line.strip() != ""]
+    return charts
+
+# One line per (name, x, y) on a single chart, used to overlay the same stat across the fights of a fight sweep
+def overlay_chart( path, title, x_title, y_title, lines, formats, width, height ):
+    import plotly.graph_objects as go
+    figure = go.Figure(layout=go.Layout(autosize=False, width=width, height=height, title=title, xaxis_title=x_title, yaxis_title=y_title))
+    for name, x, y in lines:
+        figure.add_trace(go.Scatter(x=x, y=y, mode="lines", name=name))
+    return {'path': path, 'figure': figure.to_json(), 'formats': formats}
+
+# Largest-triangle-three-buckets: keeps the first and last point and from every bucket in between the point that spans the largest
+# triangle with the point kept before it and the average of the next bucket, so peaks and breakpoints survive the thinning.
+# Returns the indices of the kept points, points with a missing x or y are never kept
+def lttb_indices( x, y, threshold ):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    valid = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    if( threshold < 3 or len(valid) <= threshold ):
+        return valid
+    x = x[valid]
+    y = y[valid]
+    n = len(valid)
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(int)
+    kept = [0]
+    a = 0
+    for i in range(threshold - 2):
+        if( i + 2 < len(edges) ):
+            next_bucket = slice(edges[i + 1], edges[i + 2])
+        else:
+            next_bucket = slice(n - 1, n)
+        average_x = x[next_bucket].mean()
+        average_y = y[next_bucket].mean()
+        bucket = np.arange(edges[i], edges[i + 1])
+        area = np.abs(( x[a] - average_x ) * ( y[bucket] - y[a] ) - ( x[a] - x[bucket] ) * ( average_y - y[a] ))
+        a = bucket[np.argmax(area)]
+        kept.append(a)
+    kept.append(n - 1)
+    return valid[kept]
@@ -0,0 +1,96 @@
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Works out how many threads each simc process gets so that all running sims together stay inside the core budget
+def threads_per_job( max_concurrent, core_budget ):
+    if( core_budget <= 0 ):
+        core_budget = os.cpu_count() or 1
+    return max(1, core_budget // max(1, max_concurrent))
+
+# Reads whatever simc writes to the pipe, simc may open it more than once so it keeps reading until the job is done
+def read_pipe( path, job_done, chunks ):
+    while( not job_done.is_set() ):
+        with open(path, "r") as f:
+            chunks.append(f.read())
+
+# Unblocks the reader if it is waiting for a writer that will never come, then waits for it to finish
+def close_pipe( path, reader ):
+    while( reader.is_alive() ):
+        try:
+            os.close(os.open(path, os.O_WRONLY | os.O_NONBLOCK))
+        except OSError:
+            pass
+        reader.join(0.05)
+    os.remove(path)
+
+# Runs a command and returns its return code, wall time and CPU time. CPU time is None where the OS cant report it for one process
+def run_timed( command, stdout ):
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=stdout)
+    if( not hasattr(os, "wait4") ):
+        return process.wait(), time.perf_counter() - start, None
+    try:
+        pid, status, usage = os.wait4(process.pid, 0)
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, time.perf_counter() - start, usage.ru_utime + usage.ru_stime
+
+def run_job( job, quiet, on_started ):
+    if( on_started is not None ):
+        on_started(job)
+    print(" ".join(job['command']))
+    stdout = subprocess.DEVNULL if quiet else None
+    # A job with capture set has its output path turned into a pipe, the result ends up in job['text'] without touching the disk
+    if( not job.get('capture') ):
+        return_code, job['wall'], job['cpu'] = run_timed(job['command'], stdout)
+        return return_code
+    os.mkfifo(job['output'])
+    job_done = threading.Event()
+    chunks = []
+    reader = threading.Thread(target=read_pipe, args=(job['output'], job_done, chunks), daemon=True)
+    reader.start()
+    try:
+        return_code, job['wall'], job['cpu'] = run_timed(job['command'], stdout)
+    finally:
+        job_done.set()
+        close_pipe(job['output'], reader)
+    job['text'] = "".join(chunks)
+    return return_code
+
+# Runs every job with at most max_concurrent simc processes alive at once.
+# on_finished( job, return_code ) is called from the calling thread as each job completes, in completion order.
+# on_started( job ) is called from the worker thread right before simc starts.
+def run_jobs( jobs, max_concurrent, on_finished, on_started=None ):
+    if( len(jobs) == 0 ):
+        return
+    max_concurrent = max(1, min(max_concurrent, len(jobs)))
+    # simc progress output from several processes at once is unreadable, only show it when running one at a time
+    quiet = max_concurrent > 1
+    pool = ThreadPoolExecutor(max_workers=max_concurrent)
+    try:
+        futures = {pool.submit(run_job, job, quiet, on_started): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            on_finished(job, future.result())
+    except BaseException:
+        # Dont start anything new on Ctrl-C or a failure while handling a result, sims already running are left to finish
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+
+# First line simc prints when run without arguments, e.g. "SimulationCraft 1105-01 for World of Warcraft 11.0.5.57171 Live ..."
+def simc_version( simc_command ):
+    try:
+        result = subprocess.run(simc_command, capture_output=True, text=True, timeout=60)
+    except (OSError, subprocess.TimeoutExpired):
+        return "unknown"
+    for line in result.stdout.splitlines():
+        if( line.startswith("SimulationCraft") ):
+            return line.strip()
+    return "unknown"
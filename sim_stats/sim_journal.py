@@ -0,0 +1,61 @@
+import json
+import os
+import threading
+
+journal_lock = threading.Lock()
+
+# Reads every complete line of a journal, a line cut short by a crash is skipped
+def read_journal( path ):
+    records = []
+    if( not os.path.isfile(path) ):
+        return records
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+# Finished point results of an unfinished journal for the same plan, or None if there is nothing to resume
+def load_journal( path, plan_id ):
+    records = read_journal(path)
+    if( len(records) == 0 or records[0].get('plan') != plan_id ):
+        return None
+    if( any(r['event'] == 'complete' for r in records) ):
+        return None
+    results = {}
+    for r in records:
+        if( r['event'] == 'result' ):
+            results[(r['stat'], r['matrix_stat'], r['point'])] = r['text']
+        if( r['event'] == 'gear_result' ):
+            results[gear_result_key(r['gear'], r['iterations'], r.get('seed'))] = r['text']
+    return results
+
+# Single sims at a gear point are keyed by their gear overrides, iteration count and seed
+def gear_result_key( gear, iterations, seed ):
+    return ('gear', tuple(tuple(g) for g in gear), iterations, seed)
+
+# Counts of finished points and jobs that were started but never finished, the ones that were in flight when the run died
+def journal_status( path ):
+    records = read_journal(path)
+    started = set(r['job'] for r in records if r['event'] == 'started')
+    finished = set(r['job'] for r in records if r['event'] == 'finished')
+    results = sum(1 for r in records if r['event'] in ('result', 'gear_result'))
+    complete = any(r['event'] == 'complete' for r in records)
+    return {'results': results, 'in_flight': len(started - finished), 'complete': complete}
+
+def open_journal( path, plan_id, resume ):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if( resume ):
+        return open(path, "a")
+    journal = open(path, "w")
+    journal_write(journal, {'event': 'plan', 'plan': plan_id})
+    return journal
+
+# Every record is flushed to disk before returning so a crash never loses a finished result
+def journal_write( journal, record ):
+    with journal_lock:
+        journal.write(json.dumps(record) + "\n")
+        journal.flush()
+        os.fsync(journal.fileno())
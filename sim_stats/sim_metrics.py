@@ -0,0 +1,96 @@
+import functools
+import json
+import threading
+import time
+
+# Wall and CPU time of every phase of a run and every simc job, written as one json record per line so a run that dies
+# still leaves everything it measured. Phases follow each other, sections are functions timed wherever they are called from,
+# so a section like result parsing also counts towards the phase it ran in.
+metrics = {'path': None, 'pending': [], 'phases': {}, 'sections': {}, 'jobs': [], 'phase': None, 'phase_start': None}
+metrics_lock = threading.Lock()
+
+def write_record( record ):
+    with metrics_lock:
+        metrics['pending'].append(record)
+        if( metrics['path'] is None ):
+            return
+        with open(metrics['path'], "a") as f:
+            for r in metrics['pending']:
+                f.write(json.dumps(r) + "\n")
+        metrics['pending'] = []
+
+# Records made before the file name is known are written once it is set
+def open_metrics( path ):
+    with metrics_lock:
+        metrics['path'] = path
+        with open(path, "w") as f:
+            f.write(json.dumps({'event': 'run', 'time': time.time()}) + "\n")
+            for r in metrics['pending']:
+                f.write(json.dumps(r) + "\n")
+        metrics['pending'] = []
+
+def add_time( totals, name, wall, cpu ):
+    entry = totals.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'count': 0})
+    entry['wall'] += wall
+    entry['cpu'] += cpu
+    entry['count'] += 1
+
+# Ends the running phase and starts the next one, None only ends it
+def next_phase( name ):
+    now = (time.perf_counter(), time.process_time())
+    if( metrics['phase'] is not None ):
+        wall = now[0] - metrics['phase_start'][0]
+        cpu = now[1] - metrics['phase_start'][1]
+        add_time(metrics['phases'], metrics['phase'], wall, cpu)
+        write_record({'event': 'phase', 'phase': metrics['phase'], 'wall': wall, 'cpu': cpu})
+    metrics['phase'] = name
+    metrics['phase_start'] = now
+
+# Decorator that adds the time of every call to a section, CPU time is this process only and includes other threads
+def timed_section( name ):
+    def wrap( function ):
+        @functools.wraps(function)
+        def timed( *args, **kwargs ):
+            start = (time.perf_counter(), time.process_time())
+            try:
+                return function(*args, **kwargs)
+            finally:
+                with metrics_lock:
+                    add_time(metrics['sections'], name, time.perf_counter() - start[0], time.process_time() - start[1])
+        return timed
+    return wrap
+
+# One finished simc job, iterations and error are whatever its result says, None when the result does not have them
+def record_job( job, return_code, iterations, error ):
+    record = {'event': 'job', 'id': job['id'], 'kind': job['kind'], 'return_code': return_code, 'wall': job.get('wall'), 'cpu': job.get('cpu'),
+              'iterations': iterations, 'error': error, 'worker': job.get('worker')}
+    metrics['jobs'].append(record)
+    write_record(record)
+
+def format_seconds( seconds ):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+# Prints progress of a batch of jobs, the ETA assumes the jobs left take as long on average as the ones done so far
+def print_progress( done, total, started ):
+    elapsed = time.perf_counter() - started
+    eta = elapsed / done * ( total - done )
+    print(f"{done}/{total} sims done, {format_seconds(elapsed)} elapsed, ETA {format_seconds(eta)}")
+
+def print_summary():
+    next_phase(None)
+    total_wall = sum(p['wall'] for p in metrics['phases'].values())
+    print(f"{'Phase':32} {'Wall':>10} {'CPU':>10} {'Share':>7}")
+    for name, p in metrics['phases'].items():
+        share = p['wall'] / total_wall * 100 if total_wall > 0 else 0
+        print(f"{name:32} {p['wall']:10.2f} {p['cpu']:10.2f} {share:6.1f}%")
+    for name, s in sorted(metrics['sections'].items(), key=lambda s: -s[1]['wall']):
+        print(f"  {name:30} {s['wall']:10.2f} {s['cpu']:10.2f} {s['count']:7d} calls")
+    jobs = metrics['jobs']
+    if( len(jobs) > 0 ):
+        job_wall = sum(j['wall'] or 0 for j in jobs)
+        job_cpu = sum(j['cpu'] or 0 for j in jobs)
+        iterations = sum(j['iterations'] or 0 for j in jobs)
+        failed = sum(1 for j in jobs if j['return_code'] != 0)
+        print(f"{len(jobs)} simc jobs, {failed} failed: {job_wall:.2f}s wall, {job_cpu:.2f}s CPU, {iterations} iterations, {job_wall / len(jobs):.2f}s wall per job")
+    write_record({'event': 'summary', 'phases': metrics['phases'], 'sections': metrics['sections'], 'jobs': len(jobs)})
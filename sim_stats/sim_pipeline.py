@@ -0,0 +1,42 @@
+import queue
+import threading
+
+# A background stage that runs post-processing work in submission order while the next sims keep running.
+# The first error stops the stage and is raised again in the submitting thread on its next submit or drain,
+# so a broken chart or csv fails the run at once instead of after the last sim.
+
+def stage_loop( stage ):
+    while( True ):
+        work = stage['queue'].get()
+        if( work is None ):
+            stage['queue'].task_done()
+            return
+        if( stage['error'] is None ):
+            try:
+                work()
+            except BaseException as e:
+                stage['error'] = e
+        stage['queue'].task_done()
+
+def start_stage( name ):
+    stage = {'queue': queue.Queue(), 'error': None}
+    stage['thread'] = threading.Thread(target=stage_loop, args=(stage,), name=name, daemon=True)
+    stage['thread'].start()
+    return stage
+
+def raise_stage_error( stage ):
+    if( stage['error'] is not None ):
+        raise stage['error']
+
+def submit( stage, work ):
+    raise_stage_error(stage)
+    stage['queue'].put(work)
+
+# Waits until everything submitted so far is done
+def drain( stage ):
+    stage['queue'].join()
+    raise_stage_error(stage)
+
+def stop_stage( stage ):
+    stage['queue'].put(None)
+    stage['thread'].join()
@@ -0,0 +1,282 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+# Queue layout inside the shared directory, a task moves pending -> claimed -> done.
+# Claiming is an atomic rename, so two workers can never both own a task, and a claim file whose modification time
+# is older than its lease belongs to a dead worker and is moved back to pending.
+queue_folders = ('pending', 'claimed', 'done')
+
+# Command options whose value is a file simc writes, the worker sends these back with the result
+output_options = ('reforge_plot_output_file', 'json2')
+# Options in a profile that write reports nobody reads on a worker, they are pointed into the task directory instead
+report_options = ('html', 'json2')
+
+# Placeholder for the worker's own task directory, replaced in every argument and input file before simc runs
+task_dir_token = "{task_dir}"
+
+def queue_paths( queue_dir ):
+    paths = {}
+    for folder in queue_folders:
+        paths[folder] = os.path.join(queue_dir, folder)
+        os.makedirs(paths[folder], exist_ok=True)
+    return paths
+
+# Every process writes its own temporary file, two workers that finish the same requeued task never write into one
+def write_atomic( path, data ):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def read_json( path ):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def redirect_reports( text ):
+    lines = []
+    for line in text.splitlines():
+        key = line.split("=", 1)[0].strip()
+        if( key in report_options and "=" in line ):
+            line = f"{key}={task_dir_token}/report_{key}{os.path.splitext(line)[1]}"
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+# Turns a local job into a task any host can run: files the command reads are sent along as text and files it writes are
+# renamed into the worker's task directory, everything else in the command is passed through unchanged
+def portable_task( job, lease_seconds ):
+    args = []
+    inputs = {}
+    outputs = {}
+    for arg in job['command'][1:]:
+        key, sep, value = arg.partition("=")
+        if( sep == "" and os.path.isfile(arg) ):
+            name = f"input_{len(inputs)}{os.path.splitext(arg)[1]}"
+            with open(arg, "r") as f:
+                inputs[name] = redirect_reports(f.read())
+            args.append(f"{task_dir_token}/{name}")
+        elif( sep != "" and key in output_options ):
+            name = f"output_{len(outputs)}{os.path.splitext(value)[1]}"
+            outputs[name] = value
+            args.append(f"{key}={task_dir_token}/{name}")
+        else:
+            args.append(arg)
+    return {'job': job['id'], 'args': args, 'inputs': inputs, 'outputs': sorted(outputs), 'lease': lease_seconds}, outputs
+
+# Moves claims that stopped getting heartbeats back to pending so another worker picks them up
+def requeue_expired( paths, names, now ):
+    for claim in os.listdir(paths['claimed']):
+        name = claim.split(".", 1)[0]
+        if( names is not None and name not in names ):
+            continue
+        claim_path = os.path.join(paths['claimed'], claim)
+        task = read_json(claim_path)
+        try:
+            expired = task is not None and now - os.path.getmtime(claim_path) > task['lease']
+        except FileNotFoundError:
+            continue
+        if( expired ):
+            try:
+                os.rename(claim_path, os.path.join(paths['pending'], name + ".json"))
+                print(f"Lease of {task['job']} on {claim.split('.')[1]} ran out, queued it again")
+            except FileNotFoundError:
+                continue
+
+# Coordinator side of the queue, same contract as sim_jobs.run_jobs: on_finished( job, return_code ) is called from the calling thread
+# as each job completes and on_started( job ) once a worker claims it. Output files are written to the paths in the local job before on_finished,
+# except for jobs with capture set, their output goes straight to job['text'].
+def run_queue_jobs( jobs, queue_dir, on_finished, on_started=None, lease_seconds=120, poll_seconds=1.0 ):
+    if( len(jobs) == 0 ):
+        return
+    paths = queue_paths(queue_dir)
+    # Names sort by creation time so workers take the oldest tasks first, across every coordinator sharing the directory
+    run_id = f"{int(time.time() * 1000):015d}-{uuid.uuid4().hex[:8]}"
+    tasks = {}
+    for n, job in enumerate(jobs):
+        name = f"{run_id}-{n:06d}"
+        task, outputs = portable_task(job, lease_seconds)
+        tasks[name] = (job, outputs)
+        write_atomic(os.path.join(paths['pending'], name + ".json"), task)
+    print(f"Queued {len(tasks)} jobs in {queue_dir}, waiting for workers")
+    started = set()
+    finished = set()
+    try:
+        while( len(tasks) > 0 ):
+            for claim in os.listdir(paths['claimed']):
+                name = claim.split(".", 1)[0]
+                if( name in tasks and name not in started ):
+                    started.add(name)
+                    if( on_started is not None ):
+                        on_started(tasks[name][0])
+            for done in sorted(os.listdir(paths['done'])):
+                name = done.split(".", 1)[0]
+                done_path = os.path.join(paths['done'], done)
+                if( name in finished and done.endswith(".json") ):
+                    # A worker whose lease ran out finished after all, the result of the requeued copy was already read
+                    try:
+                        os.remove(done_path)
+                    except FileNotFoundError:
+                        pass
+                    continue
+                if( name not in tasks or not done.endswith(".json") ):
+                    continue
+                result = read_json(done_path)
+                if( result is None ):
+                    continue
+                job, outputs = tasks.pop(name)
+                finished.add(name)
+                job['wall'] = result.get('wall')
+                job['cpu'] = result.get('cpu')
+                job['worker'] = result['worker']
+                for output_name, local_path in outputs.items():
+                    if( output_name not in result['outputs'] ):
+                        continue
+                    if( job.get('capture') and local_path == job['output'] ):
+                        job['text'] = result['outputs'][output_name]
+                        continue
+                    with open(local_path, "w", newline="") as f:
+                        f.write(result['outputs'][output_name])
+                os.remove(done_path)
+                print(f"{job['id']} finished on {result['worker']} with return code {result['return_code']}")
+                on_finished(job, result['return_code'])
+            requeue_expired(paths, tasks, time.time())
+            if( len(tasks) > 0 ):
+                time.sleep(poll_seconds)
+    finally:
+        # Take back every task whose result is not read. Workers stop a task at their next heartbeat once its claim is gone
+        for folder in queue_folders:
+            for file_name in os.listdir(paths[folder]):
+                if( file_name.split(".", 1)[0] in tasks and file_name.endswith(".json") ):
+                    try:
+                        os.remove(os.path.join(paths[folder], file_name))
+                    except FileNotFoundError:
+                        pass
+
+# Starts workers on this host, used when the queue only has to spread jobs over local processes or to try a setup before adding other hosts
+def start_local_workers( queue_dir, count, simc_command, threads ):
+    worker_script = os.path.join(os.path.dirname(os.path.realpath(__file__)), "sim_worker.py")
+    workers = []
+    for i in range(count):
+        command = [sys.executable, worker_script, queue_dir, "--simc", simc_command, "--threads", str(threads), "--name", f"{socket.gethostname()}-local{i}"]
+        workers.append(subprocess.Popen(command, stdout=subprocess.DEVNULL))
+    return workers
+
+def stop_local_workers( workers ):
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.wait()
+
+# Worker side, takes the oldest pending task or returns None if there is nothing to do
+def claim_task( paths, worker_name ):
+    for pending in sorted(os.listdir(paths['pending'])):
+        if( not pending.endswith(".json") ):
+            continue
+        name = pending.split(".", 1)[0]
+        claim_path = os.path.join(paths['claimed'], f"{name}.{worker_name}.json")
+        try:
+            os.rename(os.path.join(paths['pending'], pending), claim_path)
+        except FileNotFoundError:
+            # Another worker got there first
+            continue
+        os.utime(claim_path)
+        task = read_json(claim_path)
+        if( task is not None ):
+            return name, claim_path, task
+    return None
+
+# A worker started with its own thread count uses it for every job, profileset jobs then run their sets one at a time on those threads
+def task_args( task, task_dir, threads ):
+    args = []
+    for arg in task['args']:
+        arg = arg.replace(task_dir_token, task_dir)
+        if( threads > 0 and arg.startswith("threads=") ):
+            arg = f"threads={threads}"
+        if( threads > 0 and arg.startswith("profileset_work_threads=") ):
+            arg = f"profileset_work_threads={threads}"
+        if( threads > 0 and arg.startswith("profileset_main_threads=") ):
+            arg = "profileset_main_threads=1"
+        args.append(arg)
+    return args
+
+# Runs simc for a claimed task, touching the claim file every quarter lease so the coordinator knows the worker is alive
+def run_task( paths, name, claim_path, task, worker_name, simc_command, threads, work_dir ):
+    task_dir = os.path.join(work_dir, name)
+    os.makedirs(task_dir, exist_ok=True)
+    for input_name, text in task['inputs'].items():
+        with open(os.path.join(task_dir, input_name), "w") as f:
+            f.write(text.replace(task_dir_token, task_dir))
+    command = [simc_command] + task_args(task, task_dir, threads)
+    print(" ".join(command))
+    # A worker runs one simc at a time, so the CPU time of all its children is the CPU time of this job
+    start_wall = time.perf_counter()
+    start_times = os.times()
+    try:
+        process = subprocess.Popen(command)
+    except OSError as e:
+        print(f"Could not start simc: {e}")
+        return_code = -1
+    else:
+        while( True ):
+            try:
+                return_code = process.wait(timeout=task['lease'] / 4)
+                break
+            except subprocess.TimeoutExpired:
+                try:
+                    os.utime(claim_path)
+                except FileNotFoundError:
+                    # The lease ran out anyway and the task was handed to someone else, no point finishing it
+                    process.kill()
+                    process.wait()
+                    return_code = None
+                    break
+    end_times = os.times()
+    wall = time.perf_counter() - start_wall
+    cpu = end_times.children_user + end_times.children_system - start_times.children_user - start_times.children_system
+    outputs = {}
+    if( return_code == 0 ):
+        for output_name in task['outputs']:
+            try:
+                with open(os.path.join(task_dir, output_name), "r") as f:
+                    outputs[output_name] = f.read()
+            except FileNotFoundError:
+                return_code = -1
+    for file_name in os.listdir(task_dir):
+        os.remove(os.path.join(task_dir, file_name))
+    os.rmdir(task_dir)
+    # A claim that is gone was requeued while simc ran, the result of the copy another worker took is the one that counts
+    if( return_code is None or not os.path.isfile(claim_path) ):
+        return
+    write_atomic(os.path.join(paths['done'], name + ".json"), {'job': task['job'], 'return_code': return_code, 'outputs': outputs, 'worker': worker_name, 'wall': wall, 'cpu': cpu})
+    try:
+        os.remove(claim_path)
+    except FileNotFoundError:
+        pass
+
+def run_worker( queue_dir, simc_command, threads=0, worker_name=None, work_dir=None, poll_seconds=2.0, once=False ):
+    paths = queue_paths(queue_dir)
+    if( worker_name is None ):
+        worker_name = f"{socket.gethostname()}-{os.getpid()}"
+    # Dots separate the task name from the worker in claim file names
+    worker_name = worker_name.replace(".", "_")
+    if( work_dir is None ):
+        work_dir = os.path.join(os.path.expanduser("~"), ".sim_worker", worker_name)
+    print(f"Worker {worker_name} taking jobs from {queue_dir}")
+    while( True ):
+        claimed = claim_task(paths, worker_name)
+        if( claimed is None ):
+            if( once ):
+                return
+            time.sleep(poll_seconds)
+            continue
+        name, claim_path, task = claimed
+        run_task(paths, name, claim_path, task, worker_name, simc_command, threads, work_dir)
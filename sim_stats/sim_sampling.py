@@ -0,0 +1,149 @@
+import numpy as np
+
+# Evenly spaced starting grid between start and stop, with the spacing rounded to a multiple of step
+def coarse_grid( start, stop, step, points ):
+    spacing = max(step, round(( stop - start ) / max(1, points) / step) * step)
+    grid = list(range(start, stop, spacing))
+    return grid + [stop]
+
+# Finds the intervals where the slope of the DPS curve changes by more than sensitivity times its noise and returns the midpoints to sim next.
+# x must be sorted, error is simc's DPS-Error which is a 95% confidence half width.
+def refine_points( x, y, error, step, sensitivity ):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    sd = np.asarray(error, dtype=float) / 1.96
+    if( len(x) < 3 ):
+        return []
+    gap = np.diff(x)
+    slope = np.diff(y) / gap
+    slope_change = np.diff(slope)
+    # Noise of a slope change around point k, which depends on points k-1, k and k+1
+    noise = np.sqrt(( sd[:-2] / gap[:-1] ) ** 2 + ( sd[1:-1] * ( 1 / gap[:-1] + 1 / gap[1:] ) ) ** 2 + ( sd[2:] / gap[1:] ) ** 2)
+    bends = np.abs(slope_change) > sensitivity * noise
+    split = np.zeros(len(gap), dtype=bool)
+    split[:-1] |= bends
+    split[1:] |= bends
+    new_points = []
+    for k in np.nonzero(split & ( gap > step ))[0]:
+        midpoint = x[k] + max(1, round(gap[k] / 2 / step)) * step
+        if( midpoint < x[k + 1] ):
+            new_points.append(int(midpoint))
+    return new_points
+
+# Inverse variance weighted mean of independent runs at the same point, as (dps, 95% error, total iterations)
+def combine_runs( runs ):
+    dps = np.array([r[0] for r in runs], dtype=float)
+    weight = 1 / ( np.array([r[1] for r in runs], dtype=float) / 1.96 ) ** 2
+    iterations = sum(r[2] or 0 for r in runs)
+    return float(np.sum(weight * dps) / np.sum(weight)), float(1.96 / np.sqrt(np.sum(weight))), iterations
+
+# 95% confidence half width of DPS per point for every interval between neighbouring points
+def derivative_error( x, error ):
+    x = np.asarray(x, dtype=float)
+    error = np.asarray(error, dtype=float)
+    return np.sqrt(error[:-1] ** 2 + error[1:] ** 2) / np.diff(x)
+
+# Per point error that brings every interval it touches down to the wanted DPS per point precision, shared equally between both ends
+def target_errors( x, error, precision ):
+    x = np.asarray(x, dtype=float)
+    target = np.asarray(error, dtype=float).copy()
+    limit = precision * np.diff(x) / np.sqrt(2)
+    too_wide = derivative_error(x, error) > precision
+    for k in np.nonzero(too_wide)[0]:
+        target[k] = min(target[k], limit[k])
+        target[k + 1] = min(target[k + 1], limit[k])
+    return target
+
+# Noise in DPS change, measured from the second differences of DPS where a smooth curve contributes almost nothing.
+# Returns the observed mean squared second difference and what it would be if every point had independent noise of its DPS-Error.
+def noise_variance( x, dps, error ):
+    x = np.asarray(x, dtype=float)
+    order = np.argsort(x)
+    dps = np.asarray(dps, dtype=float)[order]
+    sd = np.asarray(error, dtype=float)[order] / 1.96
+    second_difference = dps[2:] - 2 * dps[1:-1] + dps[:-2]
+    independent = sd[:-2] ** 2 + 4 * sd[1:-1] ** 2 + sd[2:] ** 2
+    return float(np.mean(second_difference ** 2)), float(np.mean(independent))
+
+# Direction numbers (s, a, m) of Sobol dimensions 2 to 7 from Joe and Kuo, dimension 1 needs none
+sobol_directions = [(1, 0, [1]), (2, 1, [1, 3]), (3, 1, [1, 3, 1]), (3, 2, [1, 1, 1]), (4, 1, [1, 1, 3, 3]), (4, 4, [1, 3, 5, 13])]
+sobol_bits = 32
+
+def sobol_direction_numbers( dimensions ):
+    directions = [[1 << ( sobol_bits - 1 - k ) for k in range(sobol_bits)]]
+    for s, a, m in sobol_directions[:dimensions - 1]:
+        v = []
+        for k in range(sobol_bits):
+            if( k < s ):
+                v.append(m[k] << ( sobol_bits - 1 - k ))
+                continue
+            value = v[k - s] ^ ( v[k - s] >> s )
+            for j in range(1, s):
+                if( ( a >> ( s - 1 - j ) ) & 1 ):
+                    value ^= v[k - j]
+            v.append(value)
+        directions.append(v)
+    return directions
+
+# Sobol points in [0, 1)^dimensions in gray code order, randomised with a digital shift from seed so every seed gives another set
+# with the same even coverage. Powers of two as samples keep the coverage best
+def sobol_points( samples, dimensions, seed ):
+    if( dimensions > len(sobol_directions) + 1 ):
+        raise ValueError(f"Sobol points are only available for up to {len(sobol_directions) + 1} dimensions")
+    directions = sobol_direction_numbers(dimensions)
+    rng = np.random.default_rng(seed)
+    x = [int(v) for v in rng.integers(0, 1 << sobol_bits, dimensions)]
+    points = np.empty((samples, dimensions))
+    for i in range(samples):
+        points[i] = [v / float(1 << sobol_bits) for v in x]
+        # The next point differs from this one in the direction number of the lowest zero bit of i
+        c = ( ~i & ( i + 1 ) ).bit_length() - 1
+        x = [v ^ directions[d][c] for d, v in enumerate(x)]
+    return points
+
+# Every dimension split into samples equal slices with exactly one point in each, slices paired up at random
+def latin_hypercube( samples, dimensions, seed ):
+    rng = np.random.default_rng(seed)
+    points = np.empty((samples, dimensions))
+    for d in range(dimensions):
+        points[:, d] = ( rng.permutation(samples) + rng.random(samples) ) / samples
+    return points
+
+# Space filling design in [0, 1)^dimensions, "sobol" or "lhs"
+def space_filling_design( design, samples, dimensions, seed ):
+    if( design == "sobol" ):
+        return sobol_points(samples, dimensions, seed)
+    if( design == "lhs" ):
+        return latin_hypercube(samples, dimensions, seed)
+    raise ValueError(f"Unknown design {design}, use sobol or lhs")
+
+# Two level design with a +1 or -1 per run and stat, every pair of stats orthogonal so their effects separate. Columns of a Sylvester
+# Hadamard matrix without its all ones column, runs is the smallest power of two above the number of stats
+def perturbation_design( dimensions ):
+    design = np.ones((1, 1))
+    while( len(design) <= dimensions ):
+        design = np.block([[design, design], [design, -design]])
+    return design[:, 1:dimensions + 1]
+
+# Two sided 95% Student t quantiles for 1 to 30 degrees of freedom, above that the expansion around 1.96 is exact to three decimals
+t95_table = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131,
+             2.120, 2.110, 2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+def t95( dof ):
+    if( dof <= len(t95_table) ):
+        return t95_table[dof - 1]
+    return 1.96 + ( 1.96 ** 3 + 1.96 ) / ( 4 * dof ) + ( 5 * 1.96 ** 5 + 16 * 1.96 ** 3 + 3 * 1.96 ) / ( 96 * dof ** 2 )
+
+# Local gradient from pairs of runs at point + delta * signs and point - delta * signs. Curvature and two stat interactions cancel in the
+# difference of a pair, the orthogonal signs separate the stats. The noise comes from how far the differences scatter around the fit,
+# so it includes whatever common random numbers cancel. Returns the gradient and its 95% confidence half width, NaN without spare pairs
+def paired_gradient( signs, differences, delta ):
+    signs = np.asarray(signs, dtype=float)
+    slopes = np.asarray(differences, dtype=float) / ( 2 * delta )
+    inverse = np.linalg.inv(signs.T @ signs)
+    gradient = inverse @ ( signs.T @ slopes )
+    dof = len(slopes) - signs.shape[1]
+    if( dof <= 0 ):
+        return gradient, np.full(len(gradient), np.nan)
+    variance = np.sum(( slopes - signs @ gradient ) ** 2) / dof
+    return gradient, t95(dof) * np.sqrt(variance * np.diag(inverse))
@@ -0,0 +1,63 @@
+import numpy as np
+
+# Pads a list of (x, dps, error) series into (series, points) arrays so they can all be fit at once, padding is masked out
+def pad_series( series ):
+    length = max(len(s[0]) for s in series)
+    x = np.zeros((len(series), length))
+    y = np.zeros((len(series), length))
+    sd = np.ones((len(series), length))
+    mask = np.zeros((len(series), length), dtype=bool)
+    for i, (sx, sy, serr) in enumerate(series):
+        n = len(sx)
+        x[i, :n] = sx
+        y[i, :n] = sy
+        sd[i, :n] = np.asarray(serr, dtype=float) / 1.96
+        mask[i, :n] = True
+    return x, y, sd, mask
+
+# Largest number of (series, point, point) elements fit in one pass, keeps memory use around a few hundred MB
+max_batch_elements = 4000000
+
+# Weighted local linear regression of DPS on rating, evaluated at every point of every series.
+# Each fit uses a tricube kernel of half width bandwidth, weighted by 1 / variance from simc's DPS-Error.
+# Returns a list of (smoothed dps, dps per point, dps per point 95% half width) per series, NaN where a fit has too few points.
+# Series are fit together in as few NumPy passes as memory allows.
+def local_linear( series, bandwidth ):
+    if( len(series) == 0 ):
+        return []
+    length = max(len(s[0]) for s in series)
+    batch = max(1, max_batch_elements // max(1, length * length))
+    fits = []
+    for start in range(0, len(series), batch):
+        fits += fit_batch(series[start:start + batch], bandwidth)
+    return fits
+
+def fit_batch( series, bandwidth ):
+    x, y, sd, mask = pad_series(series)
+    known_error = np.isfinite(sd) & ( sd > 0 )
+    # Without an error column every point gets the same weight and there is no confidence band
+    has_error = np.all(known_error | ~mask, axis=1)
+    sd = np.where(known_error, sd, 1.0)
+    # d[s, i, j] is the distance from evaluation point i to data point j in series s
+    d = x[:, None, :] - x[:, :, None]
+    kernel = np.clip(1 - np.abs(d / bandwidth) ** 3, 0, None) ** 3
+    w = kernel * mask[:, None, :] / sd[:, None, :] ** 2
+    s0 = w.sum(axis=2)
+    s1 = ( w * d ).sum(axis=2)
+    s2 = ( w * d ** 2 ).sum(axis=2)
+    t0 = ( w * y[:, None, :] ).sum(axis=2)
+    t1 = ( w * d * y[:, None, :] ).sum(axis=2)
+    det = s0 * s2 - s1 ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        det = np.where(np.abs(det) > 1e-12 * s0 * s2, det, np.nan)
+        level = ( s2 * t0 - s1 * t1 ) / det
+        slope = ( s0 * t1 - s1 * t0 ) / det
+        # The slope is a linear combination of the data points, so its variance is the sum of squared weights times each point's variance
+        slope_weights = w * ( s0[:, :, None] * d - s1[:, :, None] ) / det[:, :, None]
+        slope_error = 1.96 * np.sqrt(( slope_weights ** 2 * sd[:, None, :] ** 2 ).sum(axis=2))
+    slope_error[~has_error] = np.nan
+    fits = []
+    for i, s in enumerate(series):
+        n = len(s[0])
+        fits.append((level[i, :n], slope[i, :n], slope_error[i, :n]))
+    return fits
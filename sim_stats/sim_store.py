@@ -0,0 +1,129 @@
+import json
+import sqlite3
+import time
+import pandas as pd
+
+# One row per simulated rating point, matrix_stat and matrix_rating are NULL for normal stat sweeps.
+# Surface points are single sims with every stat set at once, a rating is NULL when the profile's rating was not known
+schema = """
+CREATE TABLE IF NOT EXISTS sweep_points (
+    sim_class TEXT NOT NULL,
+    specilization TEXT NOT NULL,
+    fight_type TEXT NOT NULL,
+    stat TEXT NOT NULL,
+    matrix_stat TEXT,
+    matrix_rating REAL,
+    rating REAL NOT NULL,
+    dps REAL NOT NULL,
+    dps_error REAL,
+    settings TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sweep_points_lookup ON sweep_points (sim_class, specilization, fight_type, stat, matrix_stat, settings, matrix_rating, rating);
+CREATE TABLE IF NOT EXISTS surface_points (
+    sim_class TEXT NOT NULL,
+    specilization TEXT NOT NULL,
+    fight_type TEXT NOT NULL,
+    design TEXT NOT NULL,
+    sample INTEGER NOT NULL,
+    haste REAL,
+    crit REAL,
+    mastery REAL,
+    versatility REAL,
+    primary_rating REAL,
+    dps REAL NOT NULL,
+    dps_error REAL,
+    iterations INTEGER,
+    settings TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS surface_points_lookup ON surface_points (sim_class, specilization, fight_type, settings, design, sample);
+CREATE TABLE IF NOT EXISTS sweep_settings (
+    settings TEXT PRIMARY KEY,
+    options TEXT NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+# The fight_type every row is stored under, stat_sim.py names its files with it and stat_cli.py looks results up by it.
+# The name_ flags tell apart the runs of a fight sweep, which differ in more than the base name shows
+def fight_type_name( fight_style, desired_targets, sim_duration, name_style=False, name_targets=False, name_duration=False ):
+    name = ""
+    if( fight_style == "Patchwerk" ):
+        if( desired_targets == 1 ):
+            name = "Single_Target"
+        if( desired_targets > 1 ):
+            name = f"{desired_targets}_Target_AoE"
+    elif( fight_style == "DungeonSlice" ):
+        name = "Mixed_Target_Count"
+    else:
+        name = "Unknown_Target_Count"
+    if( name_style ):
+        name = f"{fight_style}_{name}"
+    if( name_targets and fight_style != "Patchwerk" ):
+        name += f"_{desired_targets}_Targets"
+    if( name_duration ):
+        name += f"_{sim_duration}s"
+    return name
+
+# Several stat_sim.py processes of a campaign write to the same store, each waits for the others' writes instead of failing.
+# The connection is shared with the post-processing thread, which only uses it while the main thread waits for it.
+def open_store( path ):
+    conn = sqlite3.connect(path, timeout=300, check_same_thread=False)
+    conn.executescript(schema)
+    return conn
+
+def save_settings( conn, settings, options ):
+    conn.execute("INSERT OR IGNORE INTO sweep_settings VALUES (?, ?, ?)", (settings, json.dumps(options, sort_keys=True), time.time()))
+    conn.commit()
+
+# Replaces whatever was stored for the same sweep point and settings, so re-running a point never duplicates rows
+def store_points( conn, sim_class, specilization, fight_type, stat, matrix_stat, matrix_rating, settings, ratings, dps, dps_error ):
+    now = time.time()
+    conn.execute("DELETE FROM sweep_points WHERE sim_class = ? AND specilization = ? AND fight_type = ? AND stat = ? AND matrix_stat IS ? AND settings = ? AND matrix_rating IS ?",
+                 (sim_class, specilization, fight_type, stat, matrix_stat, settings, matrix_rating))
+    conn.executemany("INSERT INTO sweep_points VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     [(sim_class, specilization, fight_type, stat, matrix_stat, matrix_rating, float(r), float(d), None if pd.isna(e) else float(e), settings, now) for r, d, e in zip(ratings, dps, dps_error)])
+    conn.commit()
+
+# Settings of the most recently stored sweep, used when no settings are asked for
+def latest_settings( conn, sim_class, specilization, fight_type, stat, matrix_stat ):
+    row = conn.execute("SELECT settings FROM sweep_points WHERE sim_class = ? AND specilization = ? AND fight_type = ? AND stat = ? AND matrix_stat IS ? ORDER BY created DESC LIMIT 1",
+                       (sim_class, specilization, fight_type, stat, matrix_stat)).fetchone()
+    return None if row is None else row[0]
+
+def query_sweep( conn, sim_class, specilization, fight_type, stat, matrix_stat=None, settings=None ):
+    if( settings is None ):
+        settings = latest_settings(conn, sim_class, specilization, fight_type, stat, matrix_stat)
+    return pd.read_sql_query("SELECT matrix_rating, rating, dps, dps_error FROM sweep_points WHERE sim_class = ? AND specilization = ? AND fight_type = ? AND stat = ? AND matrix_stat IS ? AND settings IS ? ORDER BY matrix_rating, rating",
+                             conn, params=(sim_class, specilization, fight_type, stat, matrix_stat, settings))
+
+# Any mix of the indexed columns as filters, e.g. query_points(conn, sim_class="mage", fight_type="Single_Target") for a season wide comparison
+def query_points( conn, **filters ):
+    where = " AND ".join(f"{column} IS ?" for column in filters)
+    sql = "SELECT * FROM sweep_points" + ( " WHERE " + where if where != "" else "" )
+    return pd.read_sql_query(sql, conn, params=tuple(filters.values()))
+
+surface_columns = ['haste', 'crit', 'mastery', 'versatility', 'primary_rating']
+
+# Replaces the samples of the same design and settings, rows is a DataFrame with sample, the surface_columns, dps, dps_error and iterations
+def store_surface_points( conn, sim_class, specilization, fight_type, settings, design, rows ):
+    now = time.time()
+    conn.execute("DELETE FROM surface_points WHERE sim_class = ? AND specilization = ? AND fight_type = ? AND settings = ? AND design = ?",
+                 (sim_class, specilization, fight_type, settings, design))
+    values = []
+    for row in rows.itertuples(index=False):
+        ratings = [None if pd.isna(getattr(row, c)) else float(getattr(row, c)) for c in surface_columns]
+        values.append((sim_class, specilization, fight_type, design, int(row.sample), *ratings, float(row.dps), None if pd.isna(row.dps_error) else float(row.dps_error),
+                       None if pd.isna(row.iterations) else int(row.iterations), settings, now))
+    conn.executemany("INSERT INTO surface_points VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", values)
+    conn.commit()
+
+# Every surface sample of the settings, or of the most recently stored ones, across all designs
+def query_surface( conn, sim_class, specilization, fight_type, settings=None ):
+    if( settings is None ):
+        row = conn.execute("SELECT settings FROM surface_points WHERE sim_class = ? AND specilization = ? AND fight_type = ? ORDER BY created DESC LIMIT 1",
+                           (sim_class, specilization, fight_type)).fetchone()
+        settings = None if row is None else row[0]
+    return pd.read_sql_query(f"SELECT design, sample, {', '.join(surface_columns)}, dps, dps_error, iterations FROM surface_points WHERE sim_class = ? AND specilization = ? AND fight_type = ? AND settings IS ? ORDER BY design, sample",
+                             conn, params=(sim_class, specilization, fight_type, settings))
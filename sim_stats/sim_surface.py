@@ -0,0 +1,181 @@
+import hashlib
+import itertools
+import json
+import numpy as np
+import pandas as pd
+from sim_store import surface_columns
+
+# Response surface of DPS over the ratings of every stat, fit to all stored results of a profile: stat sweeps, matrix sweeps and surface samples.
+# The model is a polynomial in the ratings, fit by least squares weighted with simc's DPS-Error, with a weak prior on the coefficients
+# so combinations the data never varied together come out uncertain instead of arbitrary. Predictions give DPS and DPS per point of
+# every stat, each with a 95% confidence half width.
+
+# Profile options that change how simc runs but not the DPS of the character, runs that only differ in these are pooled
+run_options = ('iterations', 'target_error', 'report_details', 'html', 'json2', 'deterministic', 'seed', 'threads')
+rating_options = {'gear_haste_rating': 'haste', 'gear_crit_rating': 'crit', 'gear_mastery_rating': 'mastery', 'gear_versatility_rating': 'versatility',
+                  'gear_strength': 'primary_rating', 'gear_agility': 'primary_rating', 'gear_intellect': 'primary_rating'}
+stat_columns = {'haste': 'haste', 'crit': 'crit', 'mastery': 'mastery', 'versatility': 'versatility', 'strength': 'primary_rating', 'agility': 'primary_rating', 'intellect': 'primary_rating'}
+
+# Splits a stored profile into the character, as a key, and the rating of every stat it sets, NaN where it sets none
+def profile_ratings( options ):
+    lines = []
+    ratings = dict.fromkeys(surface_columns, float('nan'))
+    for line in options.get('profile', "").splitlines():
+        line = line.strip()
+        if( line == "" or line.startswith("#") or "=" not in line ):
+            continue
+        key, value = line.split("=", 1)
+        if( key.startswith("dps_plot_") or key in run_options ):
+            continue
+        if( key in rating_options ):
+            ratings[rating_options[key]] = float(value)
+            continue
+        lines.append(line)
+    lines.append(options.get('simc', ""))
+    return hashlib.sha256("\n".join(lines).encode("utf-8")).hexdigest(), ratings
+
+# Every stored result of the character most recently simmed for this class, spec and fight, as absolute ratings of every stat with dps and dps_error.
+# Sweep ratings are stored relative to the profile, the profile of each run says where they start
+def load_surface_points( conn, sim_class, specilization, fight_type ):
+    settings = pd.read_sql_query("SELECT settings, options FROM sweep_settings", conn)
+    profiles = {}
+    for row in settings.itertuples(index=False):
+        profiles[row.settings] = profile_ratings(json.loads(row.options))
+    sweeps = pd.read_sql_query("SELECT stat, matrix_stat, matrix_rating, rating, dps, dps_error, settings, created FROM sweep_points WHERE sim_class = ? AND specilization = ? AND fight_type = ?",
+                               conn, params=(sim_class, specilization, fight_type))
+    samples = pd.read_sql_query(f"SELECT {', '.join(surface_columns)}, dps, dps_error, settings, created FROM surface_points WHERE sim_class = ? AND specilization = ? AND fight_type = ?",
+                                conn, params=(sim_class, specilization, fight_type))
+    sweeps = sweeps[sweeps['settings'].isin(profiles.keys())]
+    samples = samples[samples['settings'].isin(profiles.keys())]
+    latest = [frame[['settings', 'created']] for frame in (sweeps, samples) if len(frame) > 0]
+    if( len(latest) == 0 ):
+        return None, {}
+    latest = pd.concat(latest).sort_values('created')
+    character, base = profiles[latest['settings'].iloc[-1]]
+    frames = []
+    for setting, (key, ratings) in profiles.items():
+        if( key != character ):
+            continue
+        rows = sweeps[sweeps['settings'] == setting]
+        if( len(rows) > 0 ):
+            points = pd.DataFrame({c: np.full(len(rows), ratings[c]) for c in surface_columns})
+            swept = rows['stat'].map(stat_columns).to_numpy()
+            matrix = rows['matrix_stat'].map(stat_columns).to_numpy()
+            for c in surface_columns:
+                is_matrix = matrix == c
+                points.loc[is_matrix, c] = rows['matrix_rating'].to_numpy(dtype=float)[is_matrix]
+                is_swept = swept == c
+                points.loc[is_swept, c] = points[c].to_numpy()[is_swept] + rows['rating'].to_numpy()[is_swept]
+            points['dps'] = rows['dps'].to_numpy()
+            points['dps_error'] = rows['dps_error'].to_numpy()
+            frames.append(points)
+        rows = samples[samples['settings'] == setting]
+        if( len(rows) > 0 ):
+            points = rows[surface_columns + ['dps', 'dps_error']].reset_index(drop=True).astype(float)
+            for c in surface_columns:
+                points[c] = points[c].fillna(ratings[c])
+            frames.append(points)
+    return pd.concat(frames, ignore_index=True), base
+
+# Exponents of every monomial of up to degree in the given number of variables, constant first
+def monomial_powers( variables, degree ):
+    powers = [p for p in itertools.product(range(degree + 1), repeat=variables) if sum(p) <= degree]
+    return np.array(sorted(powers, key=lambda p: ( sum(p), [-e for e in p] )), dtype=float).reshape(len(powers), variables)
+
+def features( z, powers ):
+    return np.prod(z[:, None, :] ** powers[None, :, :], axis=2)
+
+# Derivative of every feature by variable j
+def feature_gradient( z, powers, j ):
+    lowered = powers.copy()
+    lowered[:, j] = np.maximum(lowered[:, j] - 1, 0)
+    return powers[:, j][None, :] * features(z, lowered)
+
+# Fits the response surface, stats that never change in points are left out and only predicted at the rating they had.
+# Points with an unknown rating of a stat that does change are dropped.
+# prior_sd is the spread allowed for the coefficients, in units of mean DPS over the sampled range of the stats
+def fit_surface( points, degree=3, prior_sd=1.0 ):
+    stats = [c for c in surface_columns if points[c].nunique() > 1]
+    if( len(stats) == 0 ):
+        raise ValueError("No stat changes in the stored results, there is nothing to fit")
+    points = points.dropna(subset=['dps'] + stats)
+    fixed = {c: float(points[c].dropna().iloc[0]) for c in surface_columns if c not in stats and points[c].notna().any()}
+    x = points[stats].to_numpy(dtype=float)
+    low = x.min(axis=0)
+    scale = x.max(axis=0) - low
+    z = ( x - low ) / scale
+    # Sobol and latin hypercube samples never land on the edges of their ranges, predictions up to one grid cell past the outermost points still count as in range
+    margin = np.array([1 / max(1, points[c].nunique() - 1) for c in stats])
+    dps = points['dps'].to_numpy(dtype=float)
+    dps_scale = dps.mean()
+    y = dps / dps_scale
+    sd = points['dps_error'].to_numpy(dtype=float) / 1.96 / dps_scale
+    missing = ~np.isfinite(sd) | ( sd <= 0 )
+    sd[missing] = np.median(sd[~missing]) if ( ~missing ).any() else 0.01
+    powers = monomial_powers(len(stats), degree)
+    phi = features(z, powers)
+    weights = 1 / sd ** 2
+    normal = phi.T @ ( phi * weights[:, None] ) + np.eye(len(powers)) / prior_sd ** 2
+    fit_covariance = np.linalg.inv(normal)
+    coefficients = fit_covariance @ ( phi.T @ ( weights * y ) )
+    residuals = y - phi @ coefficients
+    dof = max(1, len(y) - len(powers))
+    reduced_chi2 = float(np.sum(weights * residuals ** 2) / dof)
+    # A model that does not fit as well as the sim noise allows gets wider confidence bands to match
+    covariance = fit_covariance * max(1.0, reduced_chi2)
+    leverage = weights * np.einsum('ij,jk,ik->i', phi, fit_covariance, phi)
+    loo = residuals / np.maximum(1e-12, 1 - leverage)
+    diagnostics = {
+        'points': len(y),
+        'parameters': len(powers),
+        'r2': float(1 - np.sum(residuals ** 2) / np.sum(( y - y.mean() ) ** 2)) if np.ptp(y) > 0 else 1.0,
+        'rmse': float(np.sqrt(np.mean(residuals ** 2)) * dps_scale),
+        'loo_rmse': float(np.sqrt(np.mean(loo ** 2)) * dps_scale),
+        'mean_sim_error': float(np.mean(sd) * 1.96 * dps_scale),
+        'reduced_chi2': reduced_chi2,
+    }
+    return {'stats': stats, 'fixed': fixed, 'low': low, 'scale': scale, 'margin': margin, 'powers': powers, 'coefficients': coefficients, 'covariance': covariance,
+            'dps_scale': dps_scale, 'degree': degree, 'diagnostics': diagnostics}
+
+# ratings is an (n, 5) array in surface_columns order, NaN for a stat the model left out. Returns DPS, DPS per point of every stat
+# and their 95% confidence half widths, NaN for stats the model does not know, and whether every point is inside the fitted range
+def predict( model, ratings ):
+    ratings = np.atleast_2d(np.asarray(ratings, dtype=float))
+    columns = [surface_columns.index(c) for c in model['stats']]
+    z = ( ratings[:, columns] - model['low'] ) / model['scale']
+    phi = features(z, model['powers'])
+    dps = phi @ model['coefficients'] * model['dps_scale']
+    dps_error = 1.96 * np.sqrt(np.einsum('ij,jk,ik->i', phi, model['covariance'], phi)) * model['dps_scale']
+    values = np.full(ratings.shape, np.nan)
+    value_errors = np.full(ratings.shape, np.nan)
+    for j, column in enumerate(columns):
+        gradient = feature_gradient(z, model['powers'], j)
+        values[:, column] = gradient @ model['coefficients'] * model['dps_scale'] / model['scale'][j]
+        value_errors[:, column] = 1.96 * np.sqrt(np.einsum('ij,jk,ik->i', gradient, model['covariance'], gradient)) * model['dps_scale'] / model['scale'][j]
+    in_range = np.all(( z >= -model['margin'] - 1e-9 ) & ( z <= 1 + model['margin'] + 1e-9 ), axis=1)
+    # The model knows nothing about a stat it never saw change, any other rating of it is out of range
+    for column, rating in model['fixed'].items():
+        asked = ratings[:, surface_columns.index(column)]
+        in_range &= np.isnan(asked) | ( asked == rating )
+    return {'dps': dps, 'dps_error': dps_error, 'values': values, 'value_errors': value_errors, 'in_range': in_range}
+
+# Points the model cannot answer well enough: outside the simmed range, DPS less precise than max_dps_error percent,
+# or DPS per point of any stat less precise than max_value_error. These are worth a new sim
+def needs_sim( prediction, max_dps_error, max_value_error ):
+    too_wide = prediction['dps_error'] > prediction['dps'] * max_dps_error / 100
+    too_wide |= np.nanmax(np.where(np.isnan(prediction['value_errors']), 0, prediction['value_errors']), axis=1) > max_value_error
+    return too_wide | ~prediction['in_range']
+
+# Model of everything stored for a class, spec and fight, None when nothing is stored
+def stored_model( conn, sim_class, specilization, fight_type, degree=3 ):
+    points, base = load_surface_points(conn, sim_class, specilization, fight_type)
+    if( points is None ):
+        return None
+    model = fit_surface(points, degree)
+    model['base'] = base
+    return model
+
+# Rating vectors in surface_columns order from {column: rating} dicts, every stat not given is at the rating of the last profile simmed
+def rating_vectors( model, queries ):
+    defaults = {c: model['base'][c] if not np.isnan(model['base'][c]) else model['fixed'].get(c, float('nan')) for c in surface_columns}
+    return np.array([[query.get(c, defaults[c]) for c in surface_columns] for query in queries], dtype=float)
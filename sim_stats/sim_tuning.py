@@ -0,0 +1,65 @@
+import json
+import os
+import platform
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Every threads per process / concurrent processes split that fits the core budget, threads going up in powers of two
+def calibration_configs( cores ):
+    configs = []
+    threads = 1
+    while( threads <= cores ):
+        configs.append((cores // threads, threads))
+        threads *= 2
+    if( configs[-1][1] != cores ):
+        configs.append((1, cores))
+    return configs
+
+def run_calibration_sim( command ):
+    return subprocess.call(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+# Runs concurrent copies of the profile with a fixed iteration count and measures the total iterations per second of the machine
+def measure_config( base_command, concurrent, threads, iterations ):
+    command = base_command + [f"iterations={iterations}", "target_error=0", f"threads={threads}", "html=", "json2=", "report_details=0"]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrent) as pool:
+        return_stats = list(pool.map(run_calibration_sim, [command] * concurrent))
+    wall = time.perf_counter() - start
+    if( any(r != 0 for r in return_stats) ):
+        return None
+    return concurrent * iterations / wall
+
+def calibrate( base_command, cores, iterations ):
+    results = []
+    for concurrent, threads in calibration_configs(cores):
+        print(f"Calibrating {concurrent} sims x {threads} threads")
+        throughput = measure_config(base_command, concurrent, threads, iterations)
+        if( throughput is None ):
+            print("    simc failed, skipping this configuration")
+            continue
+        print(f"    {throughput:.1f} iterations per second")
+        results.append({'max_concurrent_sims': concurrent, 'threads': threads, 'iterations_per_second': throughput})
+    if( len(results) == 0 ):
+        return None
+    best = max(results, key=lambda r: r['iterations_per_second'])
+    return {'max_concurrent_sims': best['max_concurrent_sims'], 'threads': best['threads'], 'iterations_per_second': best['iterations_per_second'], 'iterations': iterations, 'results': results, 'time': time.time()}
+
+# The best split depends on the machine, the simc build, the spec and the fight, so all of them make up the key
+def tuning_key( version, sim_class, specilization, fight_style, desired_targets, sim_duration ):
+    return f"{platform.node()}|{version}|{sim_class}_{specilization}|{fight_style}|{desired_targets}|{sim_duration}"
+
+def load_tuning( path, key ):
+    if( not os.path.isfile(path) ):
+        return None
+    with open(path, "r") as f:
+        return json.load(f).get(key)
+
+def save_tuning( path, key, tuning ):
+    stored = {}
+    if( os.path.isfile(path) ):
+        with open(path, "r") as f:
+            stored = json.load(f)
+    stored[key] = tuning
+    with open(path, "w") as f:
+        json.dump(stored, f, indent=2)
@@ -0,0 +1,27 @@
+import argparse
+import os
+import platform
+from sim_queue import run_worker
+
+# Runs simc jobs from a queue directory shared with a stat_sim.py run that has execution_backend = "queue".
+# Start as many as you like, on this host or any other host that can see the directory, e.g.
+#   python sim_worker.py /mnt/shared/sim_queue --threads 8
+# Only needs the standard library and a simc binary, every file a job needs travels with it through the queue.
+
+simc_dir = os.path.join(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'simc')))
+match platform.system():
+    case "Windows":
+        default_simc = os.path.join(simc_dir, "simc.exe")
+    case _:
+        default_simc = os.path.join(simc_dir, "simc")
+
+parser = argparse.ArgumentParser(description="Runs stat_sim jobs from a shared queue directory")
+parser.add_argument("queue_dir", help="Queue directory, the same path the coordinator has as queue_dir")
+parser.add_argument("--simc", default=default_simc, help="simc binary to run jobs with")
+parser.add_argument("--threads", type=int, default=0, help="Threads per sim on this host, 0 keeps what the coordinator asked for")
+parser.add_argument("--name", default=None, help="Worker name shown in the coordinator output, defaults to host-pid")
+parser.add_argument("--work-dir", default=None, help="Local scratch directory for job files")
+parser.add_argument("--once", action="store_true", help="Exit once the queue is empty instead of waiting for more jobs")
+args = parser.parse_args()
+
+run_worker(args.queue_dir, args.simc, args.threads, args.name, args.work_dir, once=args.once)
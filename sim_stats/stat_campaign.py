@@ -0,0 +1,160 @@
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from sim_jobs import threads_per_job
+from sim_queue import start_local_workers, stop_local_workers
+from sim_charts import export_charts, read_batch_files, overlay_chart
+
+# Runs stat_sim.py for every spec in a campaign manifest at the same time, all of them feeding one shared job queue that a single
+# pool of workers drains. The machine stays busy from the first sim of the first spec to the last sim of the last one, instead of
+# idling between hand started runs. Usage:
+#   python stat_campaign.py campaign.json
+#
+# Manifest layout, see campaign_example.json:
+#   "settings": stat_sim.py options shared by every spec, e.g. sim_haste, iter, fight_style
+#   "specs": one entry per spec with at least input_profile, sim_class and specilization, plus any option that only applies to that spec
+#   "workers": simc processes on this host, 0 uses one per core. Other hosts can add workers with sim_worker.py on queue_dir
+#   "threads": threads per simc process, 0 splits the cores evenly over the workers
+#   "queue_dir": queue shared with the workers, empty uses campaign_queue next to this script
+#   "chart_processes": processes rendering the charts of every spec once the last spec is done, 0 uses one per core
+#   "fights": fight options to sweep, e.g. {"desired_targets": [1, 3, 5, 8], "sim_duration": [120, 300]}. Every spec runs once per combination,
+#             all in the same queue and cache, and every stat gets a chart overlaying its curve in each fight
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+
+# Options the campaign decides for every spec, each spec only coordinates and the shared workers run the sims
+campaign_options = {
+    'execution_backend': "queue",
+    'queue_local_workers': 0,
+    'graph_open': False,
+    'auto_tune': False,
+    'run_calibration': False,
+}
+
+def spec_name( spec ):
+    return f"{spec['sim_class']}_{spec['specilization']}_{os.path.splitext(spec['input_profile'])[0]}"
+
+fight_options = ('fight_style', 'desired_targets', 'sim_duration')
+
+# Every combination of the swept fight options, a single empty fight when nothing is swept
+def fight_variants( fights ):
+    for key in fights:
+        if( key not in fight_options ):
+            sys.exit(f"Only {', '.join(fight_options)} can be swept in fights, got {key}")
+        if( len(set(map(str, fights[key]))) != len(fights[key]) ):
+            sys.exit(f"fights sweeps {key} over {fights[key]}, every value can only be given once")
+    keys = sorted(fights)
+    variants = [dict(zip(keys, values)) for values in itertools.product(*[fights[key] for key in keys])]
+    # Every swept option goes into the fight name, otherwise runs that share a name would write over each other's files and results
+    for key, name_option in (('fight_style', 'fight_name_style'), ('desired_targets', 'fight_name_targets'), ('sim_duration', 'fight_name_duration')):
+        if( len(fights.get(key, [])) > 1 ):
+            for variant in variants:
+                variant[name_option] = True
+    return variants
+
+def fight_label( fight ):
+    return "_".join(f"{key}_{value}" for key, value in fight.items() if key in fight_options)
+
+def load_manifest( path ):
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    for spec in manifest['specs']:
+        for key in ('input_profile', 'sim_class', 'specilization'):
+            if( key not in spec ):
+                sys.exit(f"Every spec in {path} needs {key}, missing in {spec}")
+    # stat_sim.py names its profile, journal, csv files, charts and store rows after class, spec and fight only, two entries of the same spec
+    # would run at the same time and write over each other
+    seen = set()
+    for spec in manifest['specs']:
+        if( (spec['sim_class'], spec['specilization']) in seen ):
+            sys.exit(f"{spec['sim_class']} {spec['specilization']} is in {path} more than once, run other profiles or options of the same spec in their own campaign")
+        seen.add((spec['sim_class'], spec['specilization']))
+    return manifest
+
+# Writes the options file of every spec and fight and starts its stat_sim.py, output goes to a log per run
+def start_spec( spec, fight, settings, queue_dir, campaign_dir ):
+    options = dict(settings)
+    options.update(spec)
+    options.update(fight)
+    options.update(campaign_options)
+    options['queue_dir'] = queue_dir
+    name = spec_name(spec) if len(fight) == 0 else f"{spec_name(spec)}_{fight_label(fight)}"
+    # Charts are rendered together once every spec is done, instead of every spec starting its own renderer
+    options['chart_batch_file'] = os.path.join(campaign_dir, f"{name}_charts.jsonl")
+    options['fight_series_file'] = os.path.join(campaign_dir, f"{name}_fight.json")
+    for path in (options['chart_batch_file'], options['fight_series_file']):
+        if( os.path.isfile(path) ):
+            os.remove(path)
+    options_path = os.path.join(campaign_dir, f"{name}.json")
+    with open(options_path, "w") as f:
+        json.dump(options, f, indent=4)
+    log = open(os.path.join(campaign_dir, f"{name}.log"), "w")
+    env = dict(os.environ, STAT_SIM_OPTIONS=options_path)
+    process = subprocess.Popen([sys.executable, "-u", os.path.join(script_dir, "stat_sim.py")], stdout=log, stderr=subprocess.STDOUT, env=env, cwd=script_dir)
+    return {'name': name, 'spec': spec_name(spec), 'process': process, 'log': log, 'started': time.time(), 'charts': options['chart_batch_file'], 'fight': options['fight_series_file']}
+
+# Every stat of a spec on one chart per stat with a line for each fight it was simmed in
+def fight_overlay_charts( runs, settings ):
+    charts = []
+    for spec in dict.fromkeys(run['spec'] for run in runs):
+        fights = []
+        for run in runs:
+            if( run['spec'] == spec and os.path.isfile(run['fight']) ):
+                with open(run['fight'], "r") as f:
+                    fights.append(json.load(f))
+        if( len(fights) < 2 ):
+            continue
+        for stat in dict.fromkeys(stat for fight in fights for stat in fight['series']):
+            lines = [(fight['fight'], fight['series'][stat]['x'], fight['series'][stat]['y']) for fight in fights if stat in fight['series']]
+            y_title = fights[0]['y_title']
+            title = f"{fights[0]['specilization']} {fights[0]['sim_class']} - {y_title} vs {stat} Rating in every fight"
+            path = os.path.join(script_dir, "chart_output", "fights", f"{spec}_{stat}_{y_title}")
+            charts.append(overlay_chart(path, title, 'Stat Rating', y_title, lines, settings.get('chart_formats', ["png"]), settings.get('graph_width', 2000), settings.get('graph_height', 1000)))
+    return charts
+
+def run_campaign( manifest_path ):
+    manifest = load_manifest(manifest_path)
+    settings = manifest.get('settings', {})
+    queue_dir = manifest.get('queue_dir', "") or os.path.join(script_dir, "campaign_queue")
+    campaign_dir = os.path.join(script_dir, "campaigns", os.path.splitext(os.path.basename(manifest_path))[0])
+    os.makedirs(campaign_dir, exist_ok=True)
+    workers = manifest.get('workers', 0) or os.cpu_count() or 1
+    threads = manifest.get('threads', 0) or threads_per_job(workers, settings.get('core_budget', 0))
+    simc_command = os.path.join(script_dir, "..", "simc", "simc.exe" if os.name == "nt" else "simc")
+    fights = fight_variants(manifest.get('fights', {}))
+    print(f"Campaign {manifest_path}: {len(manifest['specs'])} specs in {len(fights)} fights, {workers} workers with {threads} threads each, logs in {campaign_dir}")
+    running = [start_spec(spec, fight, settings, queue_dir, campaign_dir) for spec in manifest['specs'] for fight in fights]
+    runs = list(running)
+    chart_files = [spec['charts'] for spec in running]
+    local_workers = start_local_workers(queue_dir, workers, simc_command, threads)
+    failed = []
+    try:
+        while( len(running) > 0 ):
+            for spec in list(running):
+                return_code = spec['process'].poll()
+                if( return_code is None ):
+                    continue
+                running.remove(spec)
+                spec['log'].close()
+                print(f"{spec['name']} finished after {time.time() - spec['started']:.0f}s with return code {return_code}, {len(running)} runs left")
+                if( return_code != 0 ):
+                    failed.append(spec['name'])
+            time.sleep(1)
+    finally:
+        for spec in running:
+            spec['process'].terminate()
+        stop_local_workers(local_workers)
+    charts = read_batch_files(chart_files) + fight_overlay_charts(runs, settings)
+    if( len(charts) > 0 ):
+        started = time.time()
+        written, skipped = export_charts(charts, manifest.get('chart_processes', 0) or os.cpu_count() or 1)
+        print(f"Charts of every spec rendered in {time.time() - started:.0f}s: {written} files written, {skipped} unchanged")
+    if( len(failed) > 0 ):
+        sys.exit(f"{len(failed)} runs failed, see their logs in {campaign_dir}: {', '.join(failed)}")
+
+if( len(sys.argv) != 2 ):
+    sys.exit("Usage: python stat_campaign.py <manifest.json>")
+run_campaign(sys.argv[1])
@@ -0,0 +1,185 @@
+import argparse
+import ast
+import json
+import math
+import os
+import runpy
+import sys
+import tempfile
+
+# One command line for everything stat_sim does, with options from config files instead of edits to stat_sim.py. Usage:
+#   python stat_cli.py run --config unholy.json --set sim_haste=true     sims and charts, like running stat_sim.py
+#   python stat_cli.py run --config unholy.json --sims-only              sims only, never imports plotly
+#   python stat_cli.py chart --config unholy.json                        redoes derived data and charts from the results store, no sims
+#   python stat_cli.py status --config unholy.json                       journal, queue and metrics of runs in progress or finished
+#   python stat_cli.py worker <queue_dir> --threads 8                    queue worker, same arguments as sim_worker.py
+#   python stat_cli.py model --config unholy.json --at haste=18000,crit=5000
+#                                                                        DPS and stat values predicted from every stored result, no sims
+# A config file is a json object of stat_sim.py options, the same format stat_campaign.py writes. Later --config files and --set
+# options replace earlier ones, anything not set keeps its value from stat_sim.py. Only the subcommand that runs imports pandas or plotly.
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+
+# --set values are json when they parse as json, so true, 3 and [1, 2] work, anything else is a string
+def parse_value( text ):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+def load_options( args ):
+    options = {}
+    for path in args.config:
+        with open(path, "r") as f:
+            options.update(json.load(f))
+    for item in args.set:
+        if( "=" not in item ):
+            sys.exit(f"--set needs key=value, got {item}")
+        key, value = item.split("=", 1)
+        options[key.strip()] = parse_value(value.strip())
+    return options
+
+# Runs stat_sim.py in this process with the options handed over the same way stat_campaign.py does
+def run_stat_sim( options ):
+    with tempfile.NamedTemporaryFile("w", suffix=".json", prefix="stat_cli_", delete=False) as f:
+        json.dump(options, f)
+        options_path = f.name
+    os.environ["STAT_SIM_OPTIONS"] = options_path
+    sys.argv = [os.path.join(script_dir, "stat_sim.py")]
+    sys.path.insert(0, script_dir)
+    try:
+        runpy.run_path(sys.argv[0], run_name="__main__")
+    finally:
+        os.remove(options_path)
+
+def command_run( args ):
+    options = load_options(args)
+    if( args.sims_only ):
+        options.update({'generate_stat_charts': False, 'generate_matrix_charts': False, 'chart_each_sweep': False})
+    run_stat_sim(options)
+
+def command_chart( args ):
+    options = load_options(args)
+    options['chart_only'] = True
+    run_stat_sim(options)
+
+# Option values status needs, from the config or else the defaults written in stat_sim.py, read as python literals without running it
+def stat_sim_option( options, key ):
+    if( key in options ):
+        return options[key]
+    with open(os.path.join(script_dir, "stat_sim.py"), "r") as f:
+        for line in f:
+            if( line.startswith(f"{key} = ") ):
+                try:
+                    return ast.literal_eval(line.split("=", 1)[1].split("#", 1)[0].strip())
+                except ( ValueError, SyntaxError ):
+                    return None
+    return None
+
+def command_status( args ):
+    from sim_journal import journal_status
+    options = load_options(args)
+    prefix = ""
+    if( len(args.config) > 0 or len(args.set) > 0 ):
+        prefix = f"{stat_sim_option(options, 'sim_class')}_{stat_sim_option(options, 'specilization')}_"
+    journal_dir = os.path.join(script_dir, "journal")
+    journals = sorted(n for n in os.listdir(journal_dir) if n.startswith(prefix) and n.endswith(".jsonl")) if os.path.isdir(journal_dir) else []
+    if( len(journals) == 0 ):
+        print("No runs found")
+    for name in journals:
+        status = journal_status(os.path.join(journal_dir, name))
+        state = "complete" if status['complete'] else f"{status['in_flight']} sims running or interrupted"
+        print(f"{name[:-len('.jsonl')]:50} {status['results']:6d} results  {state}")
+        show_metrics(os.path.join(script_dir, "data_output", name.replace(".jsonl", "_metrics.jsonl")))
+    queue_dir = stat_sim_option(options, 'queue_dir') or os.path.join(script_dir, "queue")
+    if( os.path.isdir(queue_dir) ):
+        counts = {folder: len([n for n in os.listdir(os.path.join(queue_dir, folder)) if n.endswith(".json")]) for folder in ('pending', 'claimed', 'done') if os.path.isdir(os.path.join(queue_dir, folder))}
+        print(f"Queue {queue_dir}: " + ", ".join(f"{count} {folder}" for folder, count in counts.items()))
+
+# Phases and sims recorded so far in a run's metrics file
+def show_metrics( path ):
+    if( not os.path.isfile(path) ):
+        return
+    with open(path, "r") as f:
+        records = [json.loads(line) for line in f if line.strip() != ""]
+    jobs = [r for r in records if r['event'] == 'job']
+    phases = [r for r in records if r['event'] == 'phase']
+    if( len(phases) > 0 ):
+        print(f"    last phase finished: {phases[-1]['phase']}, {sum(p['wall'] for p in phases):.0f}s so far")
+    if( len(jobs) > 0 ):
+        print(f"    {len(jobs)} sims done, {sum(1 for j in jobs if j['return_code'] != 0)} failed, {sum(j['wall'] or 0 for j in jobs) / len(jobs):.1f}s wall per sim")
+
+def fight_type( options ):
+    from sim_store import fight_type_name
+    return fight_type_name(*(stat_sim_option(options, option) for option in ['fight_style', 'desired_targets', 'sim_duration', 'fight_name_style', 'fight_name_targets', 'fight_name_duration']))
+
+# --at haste=18000,crit=5000 as {column: rating}, primary or the primary stat's name both mean the primary stat
+def parse_query( text ):
+    from sim_surface import stat_columns
+    query = {}
+    for item in text.split(","):
+        stat, rating = item.split("=", 1)
+        stat = stat.strip()
+        if( stat != "primary" and stat not in stat_columns ):
+            sys.exit(f"Unknown stat {stat} in --at {text}")
+        query['primary_rating' if stat == "primary" else stat_columns[stat]] = float(rating)
+    return query
+
+def command_model( args ):
+    import time
+    from sim_store import open_store, surface_columns
+    from sim_surface import stored_model, rating_vectors, predict, needs_sim
+    options = load_options(args)
+    sim_class = stat_sim_option(options, 'sim_class')
+    specilization = stat_sim_option(options, 'specilization')
+    started = time.perf_counter()
+    model = stored_model(open_store(os.path.join(script_dir, "results.sqlite")), sim_class, specilization, fight_type(options), args.degree)
+    if( model is None ):
+        sys.exit(f"Nothing stored for {sim_class} {specilization} {fight_type(options)}")
+    d = model['diagnostics']
+    print(f"Degree {model['degree']} model of {', '.join(model['stats'])} fit to {d['points']} points in {( time.perf_counter() - started ) * 1000:.0f}ms")
+    print(f"    R2 {d['r2']:.4f}, RMSE {d['rmse']:.1f} DPS, leave one out RMSE {d['loo_rmse']:.1f} DPS, mean sim error {d['mean_sim_error']:.1f} DPS, reduced chi2 {d['reduced_chi2']:.2f}")
+    if( d['reduced_chi2'] > 2 ):
+        print("    The model misses more than the sim noise explains, its confidence bands are widened to match. A higher --degree may fit better")
+    # Without --at the profile's own ratings are asked for
+    queries = [parse_query(q) for q in args.at] or [{}]
+    ratings = rating_vectors(model, queries)
+    prediction = predict(model, ratings)
+    suggest = needs_sim(prediction, args.max_dps_error, args.max_value_error)
+    for k in range(len(queries)):
+        print(" ".join(f"{c}={ratings[k, i]:.0f}" for i, c in enumerate(surface_columns) if not math.isnan(ratings[k, i])) + f": {prediction['dps'][k]:.0f} DPS +- {prediction['dps_error'][k]:.0f}")
+        for i, c in enumerate(surface_columns):
+            if( not math.isnan(prediction['values'][k, i]) ):
+                print(f"    {c:15} {prediction['values'][k, i]:8.3f} +- {prediction['value_errors'][k, i]:.3f} DPS per point")
+        if( suggest[k] ):
+            reason = "outside the simmed ratings" if not prediction['in_range'][k] else "too uncertain"
+            print(f"    {reason}, worth a new sim, e.g. with surface_sampling over this region")
+
+def command_worker( args ):
+    sys.argv = [os.path.join(script_dir, "sim_worker.py")] + args.worker_args
+    sys.path.insert(0, script_dir)
+    runpy.run_path(sys.argv[0], run_name="__main__")
+
+parser = argparse.ArgumentParser(description="Stat sims, charts and queue workers")
+commands = parser.add_subparsers(dest="command", required=True)
+for name, function, help_text in [("run", command_run, "Sim and chart"), ("chart", command_chart, "Redo derived data and charts from stored results without simming"), ("status", command_status, "Show journals, queue and metrics")]:
+    command = commands.add_parser(name, help=help_text)
+    command.add_argument("--config", action="append", default=[], help="json file of stat_sim.py options, can be given more than once")
+    command.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="Single option, replaces the config files")
+    command.set_defaults(function=function)
+    if( name == "run" ):
+        command.add_argument("--sims-only", action="store_true", help="Skip every chart, plotly is never imported")
+model = commands.add_parser("model", help="Predict DPS and stat values from every stored result")
+model.add_argument("--config", action="append", default=[], help="json file of stat_sim.py options, can be given more than once")
+model.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="Single option, replaces the config files")
+model.add_argument("--at", action="append", default=[], metavar="STAT=RATING,...", help="Ratings to predict at, stats not given keep the rating of the profile. Can be given more than once, without it the profile's ratings are used")
+model.add_argument("--degree", type=int, default=3, help="Polynomial degree of the model")
+model.add_argument("--max-dps-error", type=float, default=0.2, help="Predicted DPS less precise than this percentage is worth a new sim")
+model.add_argument("--max-value-error", type=float, default=0.1, help="Predicted DPS per point less precise than this is worth a new sim")
+model.set_defaults(function=command_model)
+worker = commands.add_parser("worker", help="Run sims from a queue directory, takes the arguments of sim_worker.py")
+worker.add_argument("worker_args", nargs=argparse.REMAINDER)
+worker.set_defaults(function=command_worker)
+
+args = parser.parse_args()
+args.function(args)
@@ -1,11 +1,26 @@
 #!/usr/bin/env python3
-import subprocess
 import pandas as pd
-import plotly.graph_objects as go
 import os
 import sys
 import platform
-from inputimeout import inputimeout, TimeoutOccurred
+import json
+import io
+import tempfile
+import shutil
+import time
+import random
+from sim_jobs import run_jobs, threads_per_job, simc_version
+from sim_queue import run_queue_jobs, start_local_workers, stop_local_workers
+from sim_tuning import calibrate, tuning_key, load_tuning, save_tuning
+from sim_cache import cache_key, cache_get, cache_put, cache_evict
+from sim_journal import load_journal, open_journal, journal_write, journal_status, gear_result_key
+from sim_sampling import coarse_grid, refine_points, combine_runs, derivative_error, target_errors, noise_variance, space_filling_design, perturbation_design, paired_gradient
+import math
+from sim_store import open_store, save_settings, fight_type_name, store_points, query_sweep, store_surface_points, surface_columns
+from sim_smoothing import local_linear
+from sim_charts import export_charts, write_batch_file, lttb_indices
+from sim_pipeline import start_stage, submit, drain, stop_stage
+from sim_metrics import next_phase, timed_section, record_job, open_metrics, print_progress, print_summary
 
 # Input Variables
 input_profile = "unh_tst.simc" # This should be a bare profile, only character info and gear
@@ -14,15 +29,54 @@ specilization = "unholy"
 fight_style = "Patchwerk" # Patchwerk, and DungeonSlice are the likely most useful for this
 desired_targets = 1 # Number of enemy targets to sim, DungeonSlice ignores this
 sim_duration = 300 # Duration of the sim in seconds
+fight_name_duration = False # Add sim_duration to the fight name in every file name and the results store, keeps runs of several durations apart. stat_campaign.py sets it when it sweeps sim_duration
+fight_name_style = False # Add fight_style to the fight name, keeps runs of several fight styles apart. stat_campaign.py sets it when it sweeps fight_style
+fight_name_targets = False # Add desired_targets to the fight name of fight styles other than Patchwerk, whose name already has it. stat_campaign.py sets it when it sweeps desired_targets
 tar_err = 0.05 # Sims target Error
 iter = 15000 # Max number of Iterations to run, will stop at this number if target error has not been reached
 pos = 1 # Plot only positive values from the current rating, set to 0 to generate both positive and negative values
 plot_step = 50 # Difference in Rating between each plot point
 plot_points = 1000 # Number of plot points to generate
 rolling_avg = 18 # Rolling average for DPS per point, set to 1 to disable rolling average
+smoothing_method = "local_linear" # "local_linear" fits DPS per point with a regression weighted by simc's DPS-Error and gives confidence bands, "rolling" uses the rolling average above
+smoothing_bandwidth = 900 # Rating on either side of a point that the local_linear fit uses, wider is smoother but hides sharp breakpoints
 report_details = 1
 optimal_raid = 1
 
+# Job Engine
+max_concurrent_sims = 1 # Number of simc processes to run side by side, matrix points and stats are all independent so this can go as high as your core budget allows
+core_budget = 0 # Total number of cores shared between all running sims, each sim gets core_budget / max_concurrent_sims threads. 0 uses every core on the machine
+auto_tune = False # Use the fastest threads / concurrent sims split measured for this machine, simc build, spec and fight. Overrides max_concurrent_sims, calibrates first if nothing is stored yet
+run_calibration = False # Always run a new calibration, can be used on its own with every sim disabled as a benchmark
+calibration_iterations = 2000 # Iterations each calibration sim runs, higher is more accurate but slower
+use_sim_cache = True # Reuse results of identical sims from earlier runs, any change to the profile, sim options, stat, rating or simc version is simmed again
+cache_max_age_days = 60 # Cached results older than this are removed
+cache_max_size_mb = 1000 # Least recently used cached results are removed once the cache grows past this size
+keep_raw_csv = False # Keep simc's raw csv output in raw_data, every result is stored in results.sqlite either way
+adaptive_sampling = False # Start stat sweeps from a coarse grid and only add rating points where the DPS curve bends, instead of simming every plot_step. Needs modify_current_stats
+adaptive_initial_points = 20 # Number of evenly spaced points in the starting grid, the finest spacing it can refine down to is plot_step. rolling_avg still applies, so lower it for adaptive sweeps
+adaptive_max_rounds = 8 # Number of refinement rounds, every round halves the gap around the bends it finds
+adaptive_sensitivity = 3 # How many times larger than its noise a change in slope has to be to count as a bend, lower values add more points
+multi_fidelity = False # Run every stat sweep point with fidelity_start_iterations first, then only spend more iterations where the DPS per point confidence interval is wider than derivative_precision. Needs modify_current_stats
+fidelity_start_iterations = 1000 # Iterations of the cheap first pass
+derivative_precision = 0.5 # Wanted 95% confidence half width of DPS per point, the sweep stops once every interval is this precise or every point is at iter iterations
+fidelity_max_rounds = 6 # Maximum number of passes that add iterations
+common_random_numbers = False # Run every point of a sweep with the same seed so most of the random noise cancels out in DPS change, the measured noise of each sweep is reported either way
+crn_seed = 31459 # Seed shared by every sweep point when common_random_numbers is enabled
+pipeline_post_processing = True # Parse, store and derive finished results on a background thread while the next sims run, instead of in between them
+chart_each_sweep = True # Export a chart of every stat sweep and matrix pair to chart_output/sweeps as soon as it finishes, so results can be checked long before the whole run ends
+record_metrics = True # Time every phase of the run and every simc job, written to data_output as _metrics.jsonl with a summary printed at the end
+chart_only = False # Skip the profile and every sim, only redo the derived data and charts from results already in the results store. Enabled stats and matrices are the ones charted
+resume_sweeps = True # Continue an interrupted run from its journal, only points that never finished are simmed again. Set to False to always start over
+execution_backend = "local" # "local" runs simc on this machine, "queue" puts every job in queue_dir for sim_worker.py processes on any number of hosts to run
+queue_dir = "" # Directory shared with the workers, e.g. a network share. Empty uses the queue directory next to this script
+queue_lease_seconds = 120 # A job whose worker has not checked in for this long is handed to another worker
+queue_local_workers = 0 # Workers to start on this host when using the queue, other hosts can join by running sim_worker.py on the same directory
+job_reports = "none" # "none" skips simc's html and json reports for sweep jobs, "per_job" writes an html report for every job to raw_data, "shared" writes them all to data_output/output.html and output.json, each job overwriting the last
+capture_sim_output = True # Read simc's results through a pipe instead of writing them to raw_data and reading them back, only on Linux and macOS unless using the queue
+dedupe_points = False # Plan every stat and matrix sweep as single gear points and sim each distinct point once, e.g. the rating 0 start of every secondary stat at a matrix point. Prints the sims saved before starting. Needs modify_current_stats, best with use_profilesets
+use_profilesets = False # Run all points of a sweep as profilesets in a single simc process instead of one process per point, saves the startup and report cost of every point. Needs modify_current_stats
+
 #----------------------------------------------------------------------------------------------------------------------------------------------------#
 # Matrix Sims attempt to highlight interactions between stats, showing how the value of one stat will change based on the rating of another          #
 # To enable matrix sims, set the variable for the stat you want to scale up to True, this will then generate the dps/point value for all other stats #
@@ -34,6 +88,33 @@ matrix_secondary_step = 100 # Difference in Rating between each matrix point, ap
 matrix_secondary_points = 5 # Number of data points to generate in the matrix, applies to the secondary matrix stats. Will be averaged, higher numbers will increase accuracy but also increase compute time
 matrix_iter = 15000 # Max number of Iterations to run for the matrix sims, will stop at this number if target error has not been reached
 
+#----------------------------------------------------------------------------------------------------------------------------------------------------#
+# Surface sampling sims rating combinations spread over several stats at once, covering how all of them interact with a few hundred sims            #
+# instead of a full grid. Every sample is a single sim stored in results.sqlite and data_output as _surface.csv for later analysis                  #
+# Runs alongside any stat or matrix sims that are enabled. Needs modify_current_stats for the stats that are not sampled to have a known rating      #
+#----------------------------------------------------------------------------------------------------------------------------------------------------#
+surface_sampling = False
+surface_design = "sobol" # "sobol" or "lhs" (latin hypercube), sobol covers the space most evenly when surface_samples is a power of two
+surface_samples = 256 # Number of rating combinations to sim
+surface_ranges = {"haste": [0, 25000], "crit": [0, 25000], "mastery": [0, 25000], "versatility": [0, 25000]} # Rating range of every sampled stat, "primary" can be added too. Stats left out keep their base rating
+surface_iterations = 10000 # Max iterations per sample, target error still applies
+surface_seed = 1 # Seed of the design, another seed gives another set of combinations with the same coverage
+
+####################################################################################################################################################
+# Stat weights give the DPS per point of every stat at one gear point from a few dozen sims, instead of a full sweep of every stat.                 #
+# Each pair of sims moves every stat up or down by stat_weight_delta at once in a pattern that keeps the stats apart, both sims of a pair share     #
+# a seed so most of the noise cancels. Rounds of pairs are added until every stat is as precise as stat_weight_precision. Runs alongside any other  #
+# sims, written to data_output as _stat_weights.csv                                                                                                #
+####################################################################################################################################################
+stat_weights = False
+stat_weight_point = {"haste": 10000, "crit": 10000, "mastery": 10000, "versatility": 10000, "primary": 40000} # Ratings of the gear point, stats left out keep their base rating
+stat_weight_stats = ["haste", "crit", "mastery", "versatility", "primary"] # Stats to weigh, "primary" is the primary stat of the spec
+stat_weight_delta = 600 # Rating every stat moves up and down by, big enough to stand out of the noise, small enough that the curve is close to straight
+stat_weight_iterations = 10000 # Max iterations per sim, target error still applies
+stat_weight_precision = 0.05 # Wanted 95% confidence half width of every stat's DPS per point
+stat_weight_max_rounds = 8 # Maximum number of rounds of pairs, each round sims the whole pattern once more with new seeds
+stat_weight_seed = 2718 # First seed of the pairs, every pair gets its own
+
 # Profile Modifications
 modify_base_profile = True # Set to False if you dont want to modify the base profile with any of the values below 
 # Set to 1 to enable that tier set bonus, set to 0 to disable it
@@ -103,21 +184,50 @@ graph_height = 1000 # Height of the graph in pixels
 graph_open = True # Open the interactive graph in a browser window when the script finishes, will still save the image to the output directory if set to false
 # Style of the graph, useful variations are "lines+markers", "lines", "markers"
 graph_style = "lines+markers"
+graph_max_points = 500 # Points drawn per line at most, longer sweeps are thinned keeping their peaks and breakpoints. The csv files and results store keep every point. 0 draws all of them
+graph_webgl_points = 1000 # Lines with more points than this are drawn with WebGL, which keeps big interactive charts responsive. 0 never uses WebGL
 # Only One of these two should be enabled at any one point in time!
 graph_dps_per_point = True # Probably the only useful graph
 graph_dps = False # Plots DPS vs Rating, same thing youd get in the simc html output, but bigger!
 # Only One of these two should be enabled at any one point in time!
 graph_matrix_dps_per_point = True
 graph_matrix_pct_increase = False
+chart_formats = ["png"] # Files written for every chart, any of "png", "svg" and "html". html is a standalone interactive chart
+chart_render_processes = 1 # Processes rendering charts at the end of a run, each keeps its own renderer. Only worth raising when a run exports many charts
+chart_batch_file = "" # Append the charts to this file instead of rendering them, stat_campaign.py uses it to render every spec's charts in one batch
+fight_series_file = "" # Write the plotted curve of every stat to this json file, stat_campaign.py overlays the fights of a fight sweep from them
+graph_confidence_bands = True # Shade the 95% confidence band around DPS per point, only available with smoothing_method = "local_linear"
 
 #----------------------------------------------------------------------------------------#
 # Code Starts Here, dont touch anything below this line unless you know what youre doing #
 #----------------------------------------------------------------------------------------#
+next_phase("setup")
+
+# Options from a json file replace the ones above, stat_campaign.py runs every spec of a campaign this way
+options_file = os.environ.get("STAT_SIM_OPTIONS", "")
+if( options_file != "" ):
+    with open(options_file, "r") as f:
+        file_options = json.load(f)
+    for key, value in file_options.items():
+        if( key not in globals() ):
+            sys.exit(f"Unknown option {key} in {options_file}")
+        globals()[key] = value
+
+# plotly takes a while to import, runs without charts never load it
+if( generate_stat_charts or generate_matrix_charts or chart_each_sweep ):
+    import plotly.graph_objects as go
+
 # Directories
 profile_dir = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "profiles")
 simc_dir = os.path.join(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'simc')))
 data_dir = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "raw_data")
 output_dir = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "data_output")
+tuning_file = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "tuning.json")
+cache_dir = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "cache")
+journal_dir = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "journal")
+if( queue_dir == "" ):
+    queue_dir = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "queue")
+store_file = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "results.sqlite")
 chart_output_dir = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "chart_output")
 weapon = ""
 
@@ -294,12 +404,23 @@ def switch_weapon():
                 case "protection":
                     return "worn_axe,id=37"
 
+if( switch_primary() is None ):
+    sys.exit(f"Unknown class and specialization {sim_class} {specilization}, check the spelling against switch_primary")
+if( desired_targets < 1 ):
+    sys.exit(f"desired_targets is {desired_targets}, simc needs at least 1 target")
+if( surface_sampling and surface_design not in ("sobol", "lhs") ):
+    sys.exit(f"Unknown surface_design {surface_design}, use sobol or lhs")
+if( stat_weights and any(s not in ['haste', 'crit', 'mastery', 'versatility', 'primary'] for s in list(stat_weight_stats) + list(stat_weight_point)) ):
+    sys.exit("stat_weight_stats and stat_weight_point only take haste, crit, mastery, versatility and primary")
+
+fight_type_string = fight_type_name(fight_style, desired_targets, sim_duration, fight_name_style, fight_name_targets, fight_name_duration)
+
+next_phase("profile generation")
+
 # Lists of elements to add to the simc profile
 sim_mod = []
 profile_mod = []
 
-base_profile = open(os.path.join(profile_dir, input_profile), "r")
-
 is_matrix_sim = False
 if any( x == True for x in [sim_haste_matrix, sim_crit_matrix, sim_mastery_matrix, sim_vers_matrix, sim_primary_matrix] ):
     is_matrix_sim = True
@@ -319,68 +440,111 @@ sim_mod.append("max_time="+str(sim_duration)+"\n")
 sim_mod.append("report_details="+str(report_details)+"\n")
 sim_mod.append("optimal_raid="+str(optimal_raid)+"\n")
 sim_mod.append("dps_plot_positive="+str(pos)+"\n")
+if( common_random_numbers ):
+    sim_mod.append("deterministic=1\n")
+    sim_mod.append("seed="+str(crn_seed)+"\n")
 sim_mod.append("iterations="+str(iter)+"\n")
-sim_mod.append("html=" + os.path.join(output_dir, "output.html") + "\n")
-sim_mod.append("json2=" + os.path.join(output_dir, "output.json") + "\n")
-
-with open(os.path.join(profile_dir, f"{sim_class}_{specilization}_input.simc"), "w+") as sim_profile:
-    for i in sim_mod:
-        sim_profile.write(i)
-    sim_profile.write("\n")
-    sim_profile.write(base_profile.read())
-    base_profile.close()
-    if( modify_current_stats ):
-        profile_mod.append("gear_crit_rating="+str(base_crit_rating)+"\n")
-        profile_mod.append("gear_haste_rating="+str(base_haste_rating)+"\n")
-        profile_mod.append("gear_mastery_rating="+str(base_mastery_rating)+"\n")
-        profile_mod.append("gear_versatility_rating="+str(base_versatility_rating)+"\n")
-        if( sim_primary ):
-            profile_mod.append("gear_"+switch_primary()+"="+str(base_primary_rating)+"\n")
-    if( modify_base_profile ):
-        profile_mod.append("potion="+potion+"\n")
-        profile_mod.append("food="+food+"\n")
-        profile_mod.append("flask="+flask+"\n")
-        profile_mod.append("augmentation="+augmentation+"\n")
-        profile_mod.append("temporary_enchant="+temporary_enchants+"\n")
-        profile_mod.append("set_bonus="+str(tier_set_prefix)+"_season_"+str(tier_set_season)+"_2pc="+str(tier_set_bonus_2pc)+"\n")
-        profile_mod.append("set_bonus="+str(tier_set_prefix)+"_season_"+str(tier_set_season)+"_4pc="+str(tier_set_bonus_4pc)+"\n")
-        if( disable_trinekts ):
-            profile_mod.append( "trinket1=\n" )
-            profile_mod.append( "trinket2=\n" )
-        if( disable_gear_effects ):
-            profile_mod.append("head=\n")
-            profile_mod.append("neck=\n")
-            profile_mod.append("shoulder=\n")
-            profile_mod.append("back=\n")
-            profile_mod.append("chest=\n")
-            profile_mod.append("wrist=\n")
-            profile_mod.append("hands=\n")
-            profile_mod.append("waist=\n")
-            profile_mod.append("legs=\n")
-            profile_mod.append("feet=\n")
-            profile_mod.append("finger1=\n")
-            profile_mod.append("finger2=\n")
-        if( disable_weapon_effects ):
-            profile_mod.append(f"main_hand={switch_weapon()}\n")
-        sim_profile.write("\n")
-        for i in profile_mod:
+if( job_reports == "shared" ):
+    sim_mod.append("html=" + os.path.join(output_dir, "output.html") + "\n")
+    sim_mod.append("json2=" + os.path.join(output_dir, "output.json") + "\n")
+
+# A chart only run never touches the profile, it only reads the results store
+if( not chart_only ):
+    base_profile = open(os.path.join(profile_dir, input_profile), "r")
+    with open(os.path.join(profile_dir, f"{sim_class}_{specilization}_{fight_type_string}_input.simc"), "w+") as sim_profile:
+        for i in sim_mod:
             sim_profile.write(i)
+        sim_profile.write("\n")
+        sim_profile.write(base_profile.read())
+        base_profile.close()
+        if( modify_current_stats ):
+            profile_mod.append("gear_crit_rating="+str(base_crit_rating)+"\n")
+            profile_mod.append("gear_haste_rating="+str(base_haste_rating)+"\n")
+            profile_mod.append("gear_mastery_rating="+str(base_mastery_rating)+"\n")
+            profile_mod.append("gear_versatility_rating="+str(base_versatility_rating)+"\n")
+            if( sim_primary ):
+                profile_mod.append("gear_"+switch_primary()+"="+str(base_primary_rating)+"\n")
+        if( modify_base_profile ):
+            profile_mod.append("potion="+potion+"\n")
+            profile_mod.append("food="+food+"\n")
+            profile_mod.append("flask="+flask+"\n")
+            profile_mod.append("augmentation="+augmentation+"\n")
+            profile_mod.append("temporary_enchant="+temporary_enchants+"\n")
+            profile_mod.append("set_bonus="+str(tier_set_prefix)+"_season_"+str(tier_set_season)+"_2pc="+str(tier_set_bonus_2pc)+"\n")
+            profile_mod.append("set_bonus="+str(tier_set_prefix)+"_season_"+str(tier_set_season)+"_4pc="+str(tier_set_bonus_4pc)+"\n")
+            if( disable_trinekts ):
+                profile_mod.append( "trinket1=\n" )
+                profile_mod.append( "trinket2=\n" )
+            if( disable_gear_effects ):
+                profile_mod.append("head=\n")
+                profile_mod.append("neck=\n")
+                profile_mod.append("shoulder=\n")
+                profile_mod.append("back=\n")
+                profile_mod.append("chest=\n")
+                profile_mod.append("wrist=\n")
+                profile_mod.append("hands=\n")
+                profile_mod.append("waist=\n")
+                profile_mod.append("legs=\n")
+                profile_mod.append("feet=\n")
+                profile_mod.append("finger1=\n")
+                profile_mod.append("finger2=\n")
+            if( disable_weapon_effects ):
+                profile_mod.append(f"main_hand={switch_weapon()}\n")
+            sim_profile.write("\n")
+            for i in profile_mod:
+                sim_profile.write(i)
 
-profile = f"{sim_class}_{specilization}_input.simc"
+profile = f"{sim_class}_{specilization}_{fight_type_string}_input.simc"
 
 match platform.system():
     case "Windows":
-        main_string = os.path.join(simc_dir, "simc.exe") + " " + os.path.join(profile_dir, profile) + " dps_plot_stat="
+        main_command = [os.path.join(simc_dir, "simc.exe"), os.path.join(profile_dir, profile)]
     case "Linux":
-        main_string = os.path.join(simc_dir, "simc") + " " + os.path.join(profile_dir, profile) + " dps_plot_stat="
+        main_command = [os.path.join(simc_dir, "simc"), os.path.join(profile_dir, profile)]
     case "Darwin":
-        main_string = os.path.join(simc_dir, "simc") + " " + os.path.join(profile_dir, profile) + " dps_plot_stat="
+        main_command = [os.path.join(simc_dir, "simc"), os.path.join(profile_dir, profile)]
+
+sim_threads = threads_per_job(max_concurrent_sims, core_budget)
+
+# Queue results always come back in memory, local ones need a named pipe
+capture_pipes = capture_sim_output and ( execution_backend == "queue" or hasattr(os, "mkfifo") )
+
+input_profile_text = ""
+if( not chart_only ):
+    with open(os.path.join(profile_dir, profile), "r") as f:
+        input_profile_text = f.read()
+
+next_phase("simc version and tuning")
+simc_build = "unknown"
+if( not chart_only and ( use_sim_cache or auto_tune or run_calibration ) ):
+    simc_build = simc_version(main_command[:1])
+
+if( not chart_only and ( auto_tune or run_calibration ) ):
+    tuning_cores = core_budget if core_budget > 0 else os.cpu_count() or 1
+    tuning_id = tuning_key(simc_build, sim_class, specilization, fight_style, desired_targets, sim_duration)
+    tuning = None if run_calibration else load_tuning(tuning_file, tuning_id)
+    if( tuning is None ):
+        tuning = calibrate(main_command, tuning_cores, calibration_iterations)
+        if( tuning is not None ):
+            save_tuning(tuning_file, tuning_id, tuning)
+    if( tuning is not None ):
+        print(f"Using {tuning['max_concurrent_sims']} concurrent sims with {tuning['threads']} threads each ({tuning['iterations_per_second']:.1f} iterations per second)")
+        if( auto_tune ):
+            max_concurrent_sims = tuning['max_concurrent_sims']
+            sim_threads = tuning['threads']
 
 stats = ['haste', 'crit', 'mastery', 'versatility', switch_primary()]
 sim_stats = []
 dont_sim_stats = []
-sim_strings = {}
-matrix_strings = {}
+sim_jobs = []
+cached_results = []
+point_sweep_stats = []
+planned_sweeps = []
+stat_results = {}
+matrix_results = {}
+matrix_next_point = {}
+matrix_rows = {}
+sweep_noise = {}
 haste_matrix_stats = []
 haste_matrix_gen_stats = []
 crit_matrix_stats = []
@@ -535,48 +699,74 @@ if( len(sim_matrix_stats) == 0 ):
     else:
         dont_sim_stats.append(switch_primary())
 
-layout = go.Layout(
-    autosize=False,
-    width=graph_width,
-    height=graph_height
-)
-
-fig=go.Figure( layout=layout )
-
-fight_type_string = ""
-if( fight_style == "Patchwerk" ):
-    if( desired_targets == 1 ):
-        fight_type_string = "Single_Target"
-    if( desired_targets > 1 ):
-        fight_type_string = f"{desired_targets}_Target_AoE"
-elif( fight_style == "DungeonSlice" ):
-    fight_type_string = "Mixed_Target_Count"
-else:
-    fight_type_string = "Unknown_Target_Count"
+if( generate_stat_charts or generate_matrix_charts or chart_each_sweep ):
+    layout = go.Layout(
+        autosize=False,
+        width=graph_width,
+        height=graph_height
+    )
+
+# Charts are collected here and rendered together once the run is done
+chart_batch = []
+
+if( record_metrics ):
+    # A chart only run keeps its own file so the metrics of the run that simmed are not lost
+    open_metrics(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}{'_chart' if chart_only else ''}_metrics.jsonl"))
+
+store = open_store(store_file)
+# A chart only run has no profile and sims nothing, every query reads the settings the sweep was last stored with
+store_settings = None
+if( not chart_only ):
+    store_settings = cache_key(input_profile_text, {}, simc_build)
+    save_settings(store, store_settings, {'profile': input_profile_text, 'simc': simc_build})
+
+@timed_section("results store")
+def store_sweep_data( stat, matrix_stat, point, data ):
+    matrix_rating = None if matrix_stat is None else point * matrix_step
+    dps_error = data[' DPS-Error'] if ' DPS-Error' in data.columns else [None] * len(data)
+    store_points(store, sim_class, specilization, fight_type_string, stat, matrix_stat, matrix_rating, store_settings, data[get_stat_name(stat)], data[' DPS'], dps_error)
+
+def sweep_table( rows, stat ):
+    return pd.DataFrame({get_stat_name(stat): rows['rating'].to_numpy(), ' DPS': rows['dps'].to_numpy(), ' DPS-Error': rows['dps_error'].to_numpy()})
 
+# Results from before the results store existed are only on disk as csv, they are moved into the store the first time they are read
 def get_old_data( stat ):
-    return pd.read_csv(os.path.join(data_dir, f"{sim_class}_{specilization}_{stat}_{fight_type_string}.csv"), skiprows=1)
+    rows = query_sweep(store, sim_class, specilization, fight_type_string, stat)
+    if( len(rows) > 0 ):
+        return sweep_table(rows, stat)
+    legacy_file = os.path.join(data_dir, f"{sim_class}_{specilization}_{stat}_{fight_type_string}.csv")
+    if( not os.path.isfile(legacy_file) ):
+        return None
+    data = pd.read_csv(legacy_file, skiprows=1)
+    dps_error = data[' DPS-Error'] if ' DPS-Error' in data.columns else [None] * len(data)
+    store_points(store, sim_class, specilization, fight_type_string, stat, None, None, "legacy", data[get_stat_name(stat)], data[' DPS'], dps_error)
+    return data
 
 def get_old_modified_data( stat ):
-    return pd.read_csv(os.path.join(output_dir, f"{sim_class}_{specilization}_{stat}_{fight_type_string}_mod.csv") )
+    data = get_old_data(stat)
+    if( data is None ):
+        return None
+    return extra_data_columns(data, stat)
 
+@timed_section("derived data")
 def get_old_matrix_data( stat, matrix_stat ):
-    return pd.read_csv(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_{matrix_stat}_{stat}_mod.csv") )
+    rows = query_sweep(store, sim_class, specilization, fight_type_string, stat, matrix_stat)
+    if( len(rows) == 0 ):
+        legacy_file = os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_{matrix_stat}_{stat}_mod.csv")
+        if( not os.path.isfile(legacy_file) ):
+            return None
+        data = pd.read_csv(legacy_file)
+        # A run that was stopped part way leaves the appended rows without Pct increase
+        if( 'Pct increase' not in data.columns ):
+            data = add_pct_increase(data)
+        return data
+    groups = list(rows.groupby('matrix_rating'))
+    tables = [sweep_table(group, stat) for rating, group in groups]
+    smooth_tables(tables, [stat] * len(tables))
+    fit_matrix_tables(tables, stat)
+    tables = [matrix_data_columns(data, matrix_stat, rating, stat) for data, (rating, group) in zip(tables, groups)]
+    return add_pct_increase(pd.concat(tables, ignore_index=True))
 
-def query_yes_no(question, default="yes"):
-    valid = {"yes": True, "y": True, "ye": True, "no": False, "n": False}
-    set_prompt = " [y/n] "
-
-    try:
-        choice = inputimeout(prompt=question+set_prompt, timeout=10)
-        if choice in valid:
-            return valid[choice]
-        else:
-            sys.stdout.write("Please respond with 'yes' or 'no' " "(or 'y' or 'n').\n")
-            query_yes_no(question, default)
-    except TimeoutOccurred:
-        return valid[default]
-        
 def get_stat_name( stat ):
     if( switch_primary() == stat ):
         stat_name = stat
@@ -584,48 +774,131 @@ def get_stat_name( stat ):
         stat_name = f"{stat}_rating"
     return stat_name
     
-def generate_extra_data( data, stat ):
+def fit_series( data, stat ):
+    if( ' DPS-Error' in data.columns ):
+        dps_error = data[' DPS-Error'].to_numpy(dtype=float)
+    else:
+        dps_error = [float('nan')] * len(data)
+    return (data[get_stat_name(stat)].to_numpy(dtype=float), data[' DPS'].to_numpy(dtype=float), dps_error)
+
+# Fits every table in one batch, each table gets the fitted DPS per point and its 95% confidence band
+def smooth_tables( tables, stats ):
+    fits = local_linear([fit_series(data, stat) for data, stat in zip(tables, stats)], smoothing_bandwidth)
+    for data, (level, slope, slope_error) in zip(tables, fits):
+        data['Smoothed DPS'] = level
+        data['Smoothed DPS per point'] = slope
+        data['DPS per point lower'] = slope - slope_error
+        data['DPS per point upper'] = slope + slope_error
+
+# A matrix point is summed up by one number, a straight line fit over the whole sweep uses every point where the plain average only depends on the first and last
+def fit_matrix_tables( tables, stat ):
+    fits = local_linear([fit_series(data, stat) for data in tables], float('inf'))
+    for data, (level, slope, slope_error) in zip(tables, fits):
+        data['Fitted DPS per point'] = slope
+        data['Fitted DPS per point lower'] = slope - slope_error
+        data['Fitted DPS per point upper'] = slope + slope_error
+
+def extra_data_columns( data, stat ):
     data['DPS change'] = ( data[' DPS'].diff() )
     data['Rating Change'] = ( data[get_stat_name(stat)].diff() )
     data['DPS per point'] = data['DPS change'] / data['Rating Change']
     data['Rolling DPS per point'] = data['DPS per point'].rolling(window=rolling_avg).mean()
+    if( 'Smoothed DPS per point' not in data.columns ):
+        smooth_tables([data], [stat])
+    return data
+
+@timed_section("derived data")
+def write_extra_data( data, stat ):
+    data = extra_data_columns(data, stat)
     data.to_csv(os.path.join(output_dir, f"{sim_class}_{specilization}_{stat}_{fight_type_string}_mod.csv"), index=False)
-    new_data = pd.read_csv(os.path.join(output_dir, f"{sim_class}_{specilization}_{stat}_{fight_type_string}_mod.csv"))
-    add_data(new_data, stat)
+    return data
 
-def generate_matrix_data( data, matrix_stat, step, point, stat ):
-    rating = step*point
-    data['DPS change'] = ( data[' DPS'].diff() )
-    data['Rating Change'] = ( data[get_stat_name(stat)].diff() )
-    data['DPS per point'] = data['DPS change'] / data['Rating Change']
-    data['Rolling DPS per point'] = data['DPS per point'].rolling(window=rolling_avg).mean()
+def generate_extra_data( data, stat, figure ):
+    add_data(write_extra_data(data, stat), stat, figure)
+
+def matrix_data_columns( data, matrix_stat, rating, stat ):
+    data = extra_data_columns(data, stat)
+    if( 'Fitted DPS per point' not in data.columns ):
+        fit_matrix_tables([data], stat)
     data[matrix_stat+' Rating'] = rating
     data['Average DPS per point'] = data['DPS per point'].mean()
     data['Average DPS'] = data[' DPS'].mean()
     indexrating = data[ (data[get_stat_name(stat)] > 0 )].index
     data.drop(indexrating, inplace=True)
-    csv_header = True
-    csv_mode = 'w'
-    if( point > 0 ):
-        csv_header = False
-        csv_mode = 'a'
+    return data
+
+@timed_section("derived data")
+def generate_matrix_data( data, matrix_stat, step, point, stat ):
+    data = matrix_data_columns(data, matrix_stat, step*point, stat)
+    # Only the new rows are appended, Pct increase needs every point so it is added once the matrix is finished
+    rows = matrix_rows.setdefault((matrix_stat, stat), [])
+    csv_header = len(rows) == 0
+    csv_mode = 'w' if csv_header else 'a'
+    rows.append(data)
     data.to_csv(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_{matrix_stat}_{stat}_mod.csv"), mode=csv_mode, header=csv_header, index=False)
-    new_data = pd.read_csv(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_{matrix_stat}_{stat}_mod.csv"))
-    new_data['Pct increase'] = ( new_data['Average DPS'].diff() / new_data['Average DPS'] ) * 100
-    new_data.to_csv(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_{matrix_stat}_{stat}_mod.csv"), index=False)
 
-def add_data( data, stat ):
+def add_pct_increase( data ):
+    data['Pct increase'] = ( data['Average DPS'].diff() / data['Average DPS'] ) * 100
+    return data
+
+@timed_section("derived data")
+def finish_matrix_data( matrix_stat, stat ):
+    rows = matrix_rows.pop((matrix_stat, stat), [])
+    if( len(rows) == 0 ):
+        return
+    data = add_pct_increase(pd.concat(rows, ignore_index=True))
+    data.to_csv(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_{matrix_stat}_{stat}_mod.csv"), index=False)
+    if( chart_each_sweep ):
+        sweep_chart( data, matrix_stat, stat )
+
+# Column plotted as DPS per point, results written before smoothing existed only have the plain one
+def dps_per_point_column( data, smoothed, plain ):
+    if( smoothing_method == "local_linear" and smoothed in data.columns ):
+        return smoothed
+    return plain
+
+# Rows of a table that get drawn, chosen from the plotted line so its band is thinned the same way
+def display_points( data, x_column, y_column ):
+    if( graph_max_points <= 0 ):
+        return lttb_indices(data[x_column], data[y_column], len(data) + 1)
+    return lttb_indices(data[x_column], data[y_column], graph_max_points)
+
+def sweep_trace( data, x_column, y_column, points, webgl=True, **kwargs ):
+    trace = go.Scatter
+    if( webgl and graph_webgl_points > 0 and len(points) > graph_webgl_points ):
+        trace = go.Scattergl
+    return trace(x=data[x_column].to_numpy()[points], y=data[y_column].to_numpy()[points], **kwargs)
+
+# Upper edge first with no line, the lower edge fills up to it. Always svg, WebGL does not draw the fill in exported images
+# and a band is a single path without markers, so it stays cheap at any size
+def add_confidence_band( figure, data, x_column, lower_column, upper_column, points, stat ):
+    if( not graph_confidence_bands or smoothing_method != "local_linear" or data[upper_column].isna().all() ):
+        return
+    figure.add_trace(sweep_trace(data, x_column, upper_column, points, False, mode="lines", line=dict(width=0), showlegend=False, hoverinfo="skip", legendgroup=stat))
+    figure.add_trace(sweep_trace(data, x_column, lower_column, points, False, mode="lines", line=dict(width=0), fill="tonexty", fillcolor="rgba(128,128,128,0.25)", showlegend=False, hoverinfo="skip", legendgroup=stat))
+
+def add_data( data, stat, figure ):
+    x_column = get_stat_name(stat)
     if( graph_dps_per_point == True ):
-        fig.add_trace(go.Scatter(x=data[get_stat_name(stat)], y=data['Rolling DPS per point'], mode=graph_style, name=get_stat_name(stat)))
+        column = dps_per_point_column(data, 'Smoothed DPS per point', 'Rolling DPS per point')
+        points = display_points(data, x_column, column)
+        if( column == 'Smoothed DPS per point' ):
+            add_confidence_band(figure, data, x_column, 'DPS per point lower', 'DPS per point upper', points, stat)
+        figure.add_trace(sweep_trace(data, x_column, column, points, mode=graph_style, name=x_column, legendgroup=stat))
     if( graph_dps == True ):
-        fig.add_trace(go.Scatter(x=data[get_stat_name(stat)], y=data[' DPS'], mode=graph_style, name=get_stat_name(stat)))
+        figure.add_trace(sweep_trace(data, x_column, ' DPS', display_points(data, x_column, ' DPS'), mode=graph_style, name=x_column))
     data.describe(include='all').to_csv(os.path.join(output_dir, f"{sim_class}_{specilization}_{stat}_{fight_type_string}_data_info.csv"), index=True)
 
-def add_matrix_data( data, matrix_stat, stat ):
+def add_matrix_data( data, matrix_stat, stat, figure ):
+    x_column = f'{matrix_stat} Rating'
     if( graph_matrix_dps_per_point == True ):
-        fig.add_trace(go.Scatter(x=data[f'{matrix_stat} Rating'], y=data['Average DPS per point'], mode=graph_style, name=stat))
+        column = dps_per_point_column(data, 'Fitted DPS per point', 'Average DPS per point')
+        points = display_points(data, x_column, column)
+        if( column == 'Fitted DPS per point' ):
+            add_confidence_band(figure, data, x_column, 'Fitted DPS per point lower', 'Fitted DPS per point upper', points, stat)
+        figure.add_trace(sweep_trace(data, x_column, column, points, mode=graph_style, name=stat, legendgroup=stat))
     if( graph_matrix_pct_increase == True ):
-        fig.add_trace(go.Scatter(x=data[f'{matrix_stat} Rating'], y=data['Pct increase'], mode=graph_style, name=stat))
+        figure.add_trace(sweep_trace(data, x_column, 'Pct increase', display_points(data, x_column, 'Pct increase'), mode=graph_style, name=stat))
     data.describe(include='all').to_csv(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_{matrix_stat}_{stat}_data_info.csv"), index=True)
 
 graph_type_string = ""
@@ -634,12 +907,14 @@ if( graph_dps_per_point == True ):
 if( graph_dps == True ):
     graph_type_string = "DPS"
 
-def generate_chart():
-    fig.update_layout(title=f'{sim_duration} second {fight_type_string} - {specilization} {sim_class} - {graph_type_string} vs Rating', xaxis_title='Stat Rating', yaxis_title=f'{graph_type_string}')
-    fig.write_image(os.path.join(chart_output_dir,f'{sim_class}_{specilization}_{fight_type_string}_{graph_type_string}.png'))
+def queue_chart( figure, path ):
+    chart_batch.append({'path': path, 'figure': figure.to_json(), 'formats': chart_formats})
     if( graph_open ):
-        fig.show()
-    fig.data = []
+        figure.show()
+
+def generate_chart( figure ):
+    figure.update_layout(title=f'{sim_duration} second {fight_type_string} - {specilization} {sim_class} - {graph_type_string} vs Rating', xaxis_title='Stat Rating', yaxis_title=f'{graph_type_string}')
+    queue_chart(figure, os.path.join(chart_output_dir, f'{sim_class}_{specilization}_{fight_type_string}_{graph_type_string}'))
 
 matrix_graph_type_string = ""
 if( graph_matrix_dps_per_point == True ):
@@ -647,146 +922,797 @@ if( graph_matrix_dps_per_point == True ):
 if( graph_matrix_pct_increase == True ):
     matrix_graph_type_string = "Percent Change"
 
-def generate_matrix_chart( stat ):
-    fig.update_layout(title=f'{sim_duration} second {fight_type_string} - {specilization} {sim_class} - {matrix_graph_type_string} vs {stat} Rating', xaxis_title=f'{stat} Rating', yaxis_title=f'{matrix_graph_type_string}')
-    fig.write_image(os.path.join(chart_output_dir, f'{sim_class}_{specilization}_{stat}_matrix_{fight_type_string}_{matrix_graph_type_string}.png'))
-    if( graph_open ):
-        fig.show()
-    fig.data = []
+def generate_matrix_chart( matrix_stat, stats ):
+    if( len(stats) == 0 ):
+        return
+    matrix_fig = go.Figure( layout=layout )
+    for stat in stats:
+        data = get_old_matrix_data(stat, matrix_stat)
+        if( data is not None ):
+            add_matrix_data(data, matrix_stat, stat, matrix_fig)
+    matrix_fig.update_layout(title=f'{sim_duration} second {fight_type_string} - {specilization} {sim_class} - {matrix_graph_type_string} vs {matrix_stat} Rating', xaxis_title=f'{matrix_stat} Rating', yaxis_title=f'{matrix_graph_type_string}')
+    queue_chart(matrix_fig, os.path.join(chart_output_dir, f'{sim_class}_{specilization}_{matrix_stat}_matrix_{fight_type_string}_{matrix_graph_type_string}'))
 
+@timed_section("chart export")
+def export_chart_batch():
+    if( len(chart_batch) == 0 ):
+        return
+    if( chart_batch_file != "" ):
+        write_batch_file(chart_batch_file, chart_batch)
+        print(f"{len(chart_batch)} charts added to {chart_batch_file}")
+        return
+    written, skipped = export_charts(chart_batch, chart_render_processes)
+    print(f"{written} chart files written, {skipped} unchanged")
 
-def matrix_sim_finished( matrix_stat, stat ):
-    new_data = pd.read_csv(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_{matrix_stat}_{stat}_mod.csv"))
-    add_matrix_data(new_data, matrix_stat, stat)
+# The plotted curve of every stat simmed in this run, thinned like the chart, for stat_campaign.py to overlay with the other fights of a fight sweep
+def write_fight_series():
+    series = {}
+    for stat in sim_stats:
+        if( stat not in stat_results ):
+            continue
+        data = stat_results[stat]
+        x_column = get_stat_name(stat)
+        column = dps_per_point_column(data, 'Smoothed DPS per point', 'Rolling DPS per point') if graph_dps_per_point else ' DPS'
+        points = display_points(data, x_column, column)
+        series[stat] = {'x': data[x_column].to_numpy()[points].tolist(), 'y': data[column].to_numpy()[points].tolist()}
+    with open(fight_series_file, "w") as f:
+        json.dump({'fight': fight_type_string, 'sim_duration': sim_duration, 'sim_class': sim_class, 'specilization': specilization, 'y_title': graph_type_string, 'series': series}, f)
 
-def run_stat_sim( stat ):
-    sim_strings[stat] = main_string+stat+" reforge_plot_output_file="+os.path.join(data_dir, f"{sim_class}_{specilization}_{stat}_{fight_type_string}.csv")
-    print(sim_strings[stat])
-    return_stat = subprocess.call(sim_strings[stat].split())
-    if( return_stat == 0 ):
-        sim_input=pd.read_csv(os.path.join(data_dir, f"{sim_class}_{specilization}_{stat}_{fight_type_string}.csv"), skiprows=1)
-        if( generate_stat_charts ):
-            generate_extra_data( sim_input, stat )
-
-def run_matrix_sim( matrix_stat, stat ):
-    for i in range(matrix_points):
-        matrix_strings[stat] = main_string+stat+" reforge_plot_output_file="+os.path.join(data_dir, f"{sim_class}_{specilization}_{fight_type_string}_{matrix_stat}_{stat}.csv")+f" gear_{get_stat_name(matrix_stat)}={i*matrix_step}"
-        print(matrix_strings[stat])
-        return_stat = subprocess.call(matrix_strings[stat].split())
-        if( return_stat == 0 ):
-            matrix_input=pd.read_csv(os.path.join(data_dir, f"{sim_class}_{specilization}_{fight_type_string}_{matrix_stat}_{stat}.csv"), skiprows=1)
-            generate_matrix_data( matrix_input, matrix_stat, matrix_step, i, stat )
-
-# Run the sim
-for i in sim_stats:
-    if( os.path.isfile(os.path.join(data_dir, f"{sim_class}_{specilization}_{i}_{fight_type_string}.csv"))):
-        if( query_yes_no(f"Data already exists for {i}, would you like to run the sim anyway?", "yes") ):
-            run_stat_sim(i)
-        else:
-            dont_sim_stats.append(i)
+# Chart of a single finished sweep on its own figure, safe to draw from the post-processing thread
+@timed_section("chart export")
+def sweep_chart( data, matrix_stat, stat ):
+    sweep_fig = go.Figure( layout=layout )
+    if( matrix_stat is None ):
+        add_data(data, stat, sweep_fig)
+        name = f"{sim_class}_{specilization}_{fight_type_string}_{stat}"
+        sweep_fig.update_layout(title=f'{sim_duration} second {fight_type_string} - {specilization} {sim_class} - {graph_type_string} vs {stat} Rating', xaxis_title='Stat Rating', yaxis_title=f'{graph_type_string}')
     else:
-        run_stat_sim(i)
+        add_matrix_data(data, matrix_stat, stat, sweep_fig)
+        name = f"{sim_class}_{specilization}_{fight_type_string}_{matrix_stat}_{stat}_matrix"
+        sweep_fig.update_layout(title=f'{sim_duration} second {fight_type_string} - {specilization} {sim_class} - {stat} {matrix_graph_type_string} vs {matrix_stat} Rating', xaxis_title=f'{matrix_stat} Rating', yaxis_title=f'{matrix_graph_type_string}')
+    export_charts([{'path': os.path.join(chart_output_dir, "sweeps", name), 'figure': sweep_fig.to_json(), 'formats': chart_formats}])
 
-for q in haste_matrix_stats:
-    if( os.path.isfile(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_haste_{q}_mod.csv") )):
-        if( query_yes_no(f"Data already exists for haste/{q}, would you like to run the sim anyway?", "yes") ):
-            run_matrix_sim('haste', q)
-    else:
-        run_matrix_sim('haste', q)
-    
-for q in crit_matrix_stats:
-    if( os.path.isfile(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_crit_{q}_mod.csv") )):
-        if( query_yes_no(f"Data already exists for crit/{q}, would you like to run the sim anyway?", "yes") ):
-            run_matrix_sim('crit', q)
+# The rating a sweep starts from, only known when the script sets it in the profile
+def sweep_base_rating( stat ):
+    if( not modify_current_stats ):
+        return None
+    match stat:
+        case "haste":
+            return base_haste_rating
+        case "crit":
+            return base_crit_rating
+        case "mastery":
+            return base_mastery_rating
+        case "versatility":
+            return base_versatility_rating
+    if( sim_primary ):
+        return base_primary_rating
+    return None
+
+def plot_points_for( matrix_stat ):
+    if( matrix_stat is None ):
+        return plot_points
+    return matrix_secondary_points
+
+# A stat sweep is one cache entry, a matrix sweep is one entry per matrix point
+def sim_cache_key( stat, matrix_stat, point ):
+    options = {'stat': stat, 'matrix_stat': matrix_stat, 'matrix_rating': None if point is None else point * matrix_step}
+    return cache_key(input_profile_text, options, simc_build)
+
+# Looks up every point in the run journal and the cache, hits are queued to be handled like finished jobs and only the misses are returned
+def unfinished_points( stat, matrix_stat, points ):
+    missing = []
+    for i in points:
+        text = journal_results.get((stat, matrix_stat, i))
+        if( text is None and use_sim_cache ):
+            text = cache_get(cache_dir, sim_cache_key(stat, matrix_stat, i))
+        if( text is None ):
+            missing.append(i)
+        else:
+            cached_results.append((stat, matrix_stat, i, text))
+    return missing
+
+# Everything that ends up in the journal or cache for a point goes through here
+@timed_section("journal and cache")
+def store_point_result( stat, matrix_stat, point, text ):
+    if( use_sim_cache ):
+        cache_put(cache_dir, sim_cache_key(stat, matrix_stat, point), text)
+    journal_write(journal, {'event': 'result', 'stat': stat, 'matrix_stat': matrix_stat, 'point': point, 'text': text})
+
+# Captured results only exist as a name in pipe_dir, run_job turns that name into a pipe while simc runs
+def output_path( name ):
+    if( capture_pipes ):
+        return os.path.join(pipe_dir, name)
+    return os.path.join(data_dir, name)
+
+def report_options( name ):
+    if( job_reports == "per_job" ):
+        return [f"html={os.path.join(data_dir, name + '.html')}"]
+    return []
+
+# The text simc wrote for a job, only left in raw_data when keep is set
+def job_output_text( job, keep ):
+    if( job.get('capture') ):
+        text = job.get('text', "")
+        if( keep ):
+            with open(os.path.join(data_dir, os.path.basename(job['output'])), "w", newline="") as f:
+                f.write(text)
+        return text
+    with open(job['output'], "r") as f:
+        text = f.read()
+    if( not keep ):
+        os.remove(job['output'])
+    return text
+
+# Writes every point of a sweep into one .simc file as profilesets, each with the same gear overrides a dps_plot point would use
+def profileset_job( name, stat, matrix_stat, points, step, start, iterations ):
+    base = sweep_base_rating(stat)
+    profileset_file = os.path.join(profile_dir, f"{name}_profilesets.simc")
+    output = output_path(f"{name}_profilesets.json")
+    profilesets = {}
+    with open(profileset_file, "w") as f:
+        for i in points:
+            for j in range(start, plot_points_for(matrix_stat) + 1):
+                set_name = f"point_{i}_{j - start}"
+                profilesets[set_name] = (i, j * step)
+                f.write(f'profileset."{set_name}"+=gear_{get_stat_name(stat)}={base + j * step}\n')
+                if( matrix_stat is not None ):
+                    f.write(f'profileset."{set_name}"+=gear_{get_stat_name(matrix_stat)}={i * matrix_step}\n')
+    command = main_command + [profileset_file, f"iterations={iterations}", f"json2={output}", f"profileset_main_threads={max_concurrent_sims}", f"profileset_work_threads={sim_threads}"] + report_options(name)
+    return {'kind': 'profileset', 'id': f"profileset/{matrix_stat}/{stat}", 'stat': stat, 'matrix_stat': matrix_stat, 'point': None, 'profilesets': profilesets, 'iterations': iterations, 'command': command, 'output': output, 'capture': capture_pipes}
+
+def use_profileset_jobs( stat ):
+    if( not use_profilesets ):
+        return False
+    if( sweep_base_rating(stat) is None ):
+        print(f"The starting {stat} rating is unknown without modify_current_stats, running {stat} as normal dps_plot sims")
+        return False
+    return True
+
+# Splits the profileset results back into one reforge plot style table per matrix point
+@timed_section("result parsing")
+def read_profileset_results( job, text ):
+    results = json.loads(text)['sim']['profilesets']['results']
+    rows = {}
+    for result in results:
+        point, rating = job['profilesets'][result['name']]
+        rows.setdefault(point, []).append((rating, result['mean'], result['mean_error']))
+    tables = {}
+    for point, point_rows in rows.items():
+        point_rows.sort()
+        tables[point] = pd.DataFrame({
+            get_stat_name(job['stat']): [r[0] for r in point_rows],
+            ' DPS': [r[1] for r in point_rows],
+            ' DPS-Error': [r[2] for r in point_rows],
+        })
+    return tables
+
+# Same layout simc uses for reforge_plot_output_file, so get_old_data can read it back
+def reforge_csv_text( data ):
+    return f"{sim_class}_{specilization} Reforge Plot Results:\n" + data.to_csv(index=False)
+
+def write_reforge_csv( data, path ):
+    with open(path, "w", newline="") as f:
+        f.write(reforge_csv_text(data))
+
+@timed_section("result parsing")
+def read_reforge_text( text ):
+    return pd.read_csv(io.StringIO(text), skiprows=1)
+
+def stat_sim_jobs( stat ):
+    if( len(unfinished_points(stat, None, [None])) == 0 ):
+        return []
+    if( adaptive_sampling or multi_fidelity ):
+        if( sweep_base_rating(stat) is not None ):
+            point_sweep_stats.append(stat)
+            return []
+        print(f"The starting {stat} rating is unknown without modify_current_stats, running {stat} as a normal dps_plot sim")
+    if( use_planned_points(stat) ):
+        planned_sweeps.append(planned_sweep(stat, None, None))
+        return []
+    if( use_profileset_jobs(stat) ):
+        start = 0 if pos else -plot_points
+        return [profileset_job(f"{sim_class}_{specilization}_{stat}_{fight_type_string}", stat, None, [None], plot_step, start, iter)]
+    name = f"{sim_class}_{specilization}_{stat}_{fight_type_string}"
+    output = output_path(f"{name}.csv")
+    command = main_command + [f"dps_plot_stat={stat}", f"reforge_plot_output_file={output}", f"threads={sim_threads}"] + report_options(name)
+    return [{'kind': 'plot', 'id': f"plot/{stat}", 'stat': stat, 'matrix_stat': None, 'point': None, 'iterations': iter, 'command': command, 'output': output, 'capture': capture_pipes}]
+
+# Every matrix point writes to its own file so the points can run side by side
+def matrix_sim_jobs( matrix_stat, stat ):
+    points = unfinished_points(stat, matrix_stat, range(matrix_points))
+    if( len(points) == 0 ):
+        return []
+    if( use_planned_points(stat) ):
+        planned_sweeps.extend(planned_sweep(stat, matrix_stat, i) for i in points)
+        return []
+    if( use_profileset_jobs(stat) ):
+        start = 0 if pos else -matrix_secondary_points
+        return [profileset_job(f"{sim_class}_{specilization}_{fight_type_string}_{matrix_stat}_{stat}", stat, matrix_stat, points, matrix_secondary_step, start, matrix_iter)]
+    jobs = []
+    for i in points:
+        name = f"{sim_class}_{specilization}_{fight_type_string}_{matrix_stat}_{stat}_{i}"
+        output = output_path(f"{name}.csv")
+        command = main_command + [f"dps_plot_stat={stat}", f"reforge_plot_output_file={output}", f"gear_{get_stat_name(matrix_stat)}={i*matrix_step}", f"threads={sim_threads}"] + report_options(name)
+        jobs.append({'kind': 'plot', 'id': f"plot/{matrix_stat}/{stat}/{i}", 'stat': stat, 'matrix_stat': matrix_stat, 'point': i, 'iterations': matrix_iter, 'command': command, 'output': output, 'capture': capture_pipes})
+    return jobs
+
+def use_planned_points( stat ):
+    if( not dedupe_points ):
+        return False
+    if( sweep_base_rating(stat) is None ):
+        print(f"The starting {stat} rating is unknown without modify_current_stats, {stat} sweeps are not deduplicated")
+        return False
+    return True
+
+# Every stat with a known rating is written out, so a point is the same gear point no matter which sweep asked for it
+def planned_gear_point( ratings ):
+    full = {stat: sweep_base_rating(stat) for stat in stats if sweep_base_rating(stat) is not None}
+    full.update(ratings)
+    return gear_point(full)
+
+# The points of a sweep, the same ratings and iterations its dps_plot sim would use, as (rating change, gear point request)
+def planned_sweep( stat, matrix_stat, point ):
+    if( matrix_stat is None ):
+        count, step, iterations = plot_points, plot_step, iter
+        fixed = {}
     else:
-        run_matrix_sim('crit', q)
+        count, step, iterations = matrix_secondary_points, matrix_secondary_step, matrix_iter
+        fixed = {matrix_stat: point * matrix_step}
+    sweep_points = []
+    for j in range(0 if pos else -count, count + 1):
+        ratings = dict(fixed)
+        ratings[stat] = sweep_base_rating(stat) + j * step
+        sweep_points.append((j * step, (planned_gear_point(ratings), iterations, None)))
+    return {'stat': stat, 'matrix_stat': matrix_stat, 'point': point, 'points': sweep_points}
+
+# What deduplication saves, shown before any sim starts
+def report_planned_sweeps():
+    requested = [request for sweep in planned_sweeps for rating, request in sweep['points']]
+    distinct = list(dict.fromkeys(requested))
+    finished = sum(1 for request in distinct if stored_gear_result(*request) is not None)
+    saved = len(requested) - len(distinct)
+    print(f"Sweep plan: {len(planned_sweeps)} sweeps ask for {len(requested)} points, {len(distinct)} of them distinct and {finished} of those already simmed. "
+          f"{len(distinct) - finished} sims to run, {saved} duplicates skipped ({100 * saved / max(1, len(requested)):.0f}%)")
+
+# Sims every distinct planned point once, then builds each sweep back into the table its dps_plot sim would have written
+def run_planned_sweeps():
+    finished = run_gear_points([request for sweep in planned_sweeps for rating, request in sweep['points']])
+    for sweep in planned_sweeps:
+        rows = [(rating, finished[request]) for rating, request in sweep['points'] if request in finished]
+        data = None
+        if( len(rows) == len(sweep['points']) ):
+            data = pd.DataFrame({get_stat_name(sweep['stat']): [r[0] for r in rows], ' DPS': [r[1][0] for r in rows], ' DPS-Error': [r[1][1] for r in rows]})
+            store_point_result(sweep['stat'], sweep['matrix_stat'], sweep['point'], reforge_csv_text(data))
+        sim_result_finished( sweep['stat'], sweep['matrix_stat'], sweep['point'], data )
 
-for q in mastery_matrix_stats:
-    if( os.path.isfile(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_mastery_{q}_mod.csv") )):
-        if( query_yes_no(f"Data already exists for mastery/{q}, would you like to run the sim anyway?", "yes") ):
-            run_matrix_sim('mastery', q)
+# Matrix points finish in any order, but the _mod.csv is built in point order, so finished points wait here until every point before them is done
+def matrix_point_finished( matrix_stat, stat, point, data ):
+    key = (matrix_stat, stat)
+    pending = matrix_results.setdefault(key, {})
+    pending[point] = data
+    while( matrix_next_point.get(key, 0) in pending ):
+        next_point = matrix_next_point.get(key, 0)
+        next_data = pending.pop(next_point)
+        if( next_data is not None ):
+            generate_matrix_data( next_data, matrix_stat, matrix_step, next_point, stat )
+        matrix_next_point[key] = next_point + 1
+        if( next_point + 1 == matrix_points ):
+            finish_matrix_data( matrix_stat, stat )
+            report_sweep_noise( matrix_stat, stat )
+
+# Compares the noise actually seen in DPS change with what independent sims with the same DPS-Error would give, a ratio well below 1 means common random numbers are working
+def add_sweep_noise( matrix_stat, stat, data ):
+    if( ' DPS-Error' not in data.columns or len(data) < 3 ):
+        return
+    observed, independent = noise_variance(data[get_stat_name(stat)], data[' DPS'], data[' DPS-Error'])
+    totals = sweep_noise.setdefault((matrix_stat, stat), [0.0, 0.0])
+    totals[0] += observed
+    totals[1] += independent
+
+def report_sweep_noise( matrix_stat, stat ):
+    totals = sweep_noise.pop((matrix_stat, stat), None)
+    if( totals is None or totals[1] == 0 ):
+        return
+    name = stat if matrix_stat is None else f"{matrix_stat}/{stat}"
+    ratio = totals[0] / totals[1]
+    print(f"{name} sweep noise: DPS change variance is {ratio:.2f}x that of independent sims")
+    noise_file = os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_sweep_noise.csv")
+    write_header = not os.path.isfile(noise_file)
+    with open(noise_file, "a") as f:
+        if( write_header ):
+            f.write("Sweep,Common random numbers,Observed variance,Independent variance,Variance ratio\n")
+        f.write(f"{name},{common_random_numbers},{totals[0]},{totals[1]},{ratio}\n")
+
+def sim_result_finished( stat, matrix_stat, point, data ):
+    if( data is not None ):
+        store_sweep_data( stat, matrix_stat, point, data )
+        add_sweep_noise( matrix_stat, stat, data )
+    if( matrix_stat is None ):
+        report_sweep_noise( None, stat )
+        if( data is not None ):
+            stat_results[stat] = write_extra_data( data, stat )
+            if( chart_each_sweep ):
+                sweep_chart( stat_results[stat], None, stat )
     else:
-        run_matrix_sim('mastery', q)
+        matrix_point_finished( matrix_stat, stat, point, data )
+
+def sim_job_started( job ):
+    journal_write(journal, {'event': 'started', 'job': job['id']})
 
-for q in vers_matrix_stats:
-    if( os.path.isfile(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_versatility_{q}_mod.csv") )):
-        if( query_yes_no(f"Data already exists for vers/{q}, would you like to run the sim anyway?", "yes") ):
-            run_matrix_sim('versatility', q)
+# Hands work to the post-processing stage, or does it right away when the stage is off
+def post_process( work ):
+    if( post_stage is None ):
+        work()
+        return
+    submit(post_stage, work)
+
+def finish_post_processing():
+    if( post_stage is not None ):
+        drain(post_stage)
+
+# Every finished job is handed to the post-processing stage so the job engine can start the next sim at once.
+# Returns only once every result is processed, callers rely on the results being there.
+def run_sim_jobs( jobs, on_finished ):
+    started = time.perf_counter()
+    done = []
+    def job_finished( job, return_stat ):
+        done.append(job)
+        print_progress(len(done), len(jobs), started)
+        post_process(lambda: on_finished(job, return_stat))
+    if( execution_backend == "queue" ):
+        run_queue_jobs(jobs, queue_dir, job_finished, sim_job_started, queue_lease_seconds)
     else:
-        run_matrix_sim('versatility', q)
+        # A profileset job already spreads its points over the whole core budget, so those run one at a time after everything else
+        run_jobs([j for j in jobs if j['kind'] not in ('profileset', 'gear_profileset')], max_concurrent_sims, job_finished, sim_job_started)
+        run_jobs([j for j in jobs if j['kind'] in ('profileset', 'gear_profileset')], 1, job_finished, sim_job_started)
+    finish_post_processing()
+
+# Mean DPS-Error of a finished job's points, None if it has none
+def mean_error( errors ):
+    errors = [e for e in errors if e is not None and not math.isnan(e)]
+    if( len(errors) == 0 ):
+        return None
+    return sum(errors) / len(errors)
+
+def sim_job_finished( job, return_stat ):
+    journal_write(journal, {'event': 'finished', 'job': job['id'], 'return_code': return_stat})
+    if( job['kind'] == 'profileset' ):
+        profileset_job_finished( job, return_stat )
+        return
+    data = None
+    if( return_stat == 0 ):
+        text = job_output_text(job, job['matrix_stat'] is None and keep_raw_csv)
+        store_point_result( job['stat'], job['matrix_stat'], job['point'], text )
+        data = read_reforge_text(text)
+    # The reforge plot has no iteration counts, every point is counted at dps_plot_iterations, which target_error can only lower
+    record_job(job, return_stat, None if data is None else len(data) * job['iterations'], None if data is None or ' DPS-Error' not in data.columns else mean_error(data[' DPS-Error'].tolist()))
+    sim_result_finished( job['stat'], job['matrix_stat'], job['point'], data )
+
+def profileset_job_finished( job, return_stat ):
+    tables = {}
+    if( return_stat == 0 ):
+        tables = read_profileset_results(job, job_output_text(job, keep_raw_csv))
+    record_job(job, return_stat, sum(len(t) for t in tables.values()) * job['iterations'] if return_stat == 0 else None, mean_error([e for t in tables.values() for e in t[' DPS-Error'].tolist()]))
+    for i, table in tables.items():
+        store_point_result( job['stat'], job['matrix_stat'], i, reforge_csv_text(table) )
+        if( job['matrix_stat'] is None and keep_raw_csv ):
+            write_reforge_csv( table, os.path.join(data_dir, f"{sim_class}_{specilization}_{job['stat']}_{fight_type_string}.csv") )
+    points = sorted(set(p[0] for p in job['profilesets'].values()), key=lambda p: -1 if p is None else p)
+    for i in points:
+        sim_result_finished( job['stat'], job['matrix_stat'], i, tables.get(i) )
+
+# A gear point is a tuple of (gear option, absolute rating) pairs, every stat not in it keeps the rating set in the profile.
+# Sim options like target_error can be added as pairs too, they apply to that point only
+def gear_point( ratings ):
+    return tuple(sorted((f"gear_{get_stat_name(stat)}", rating) for stat, rating in ratings.items()))
+
+def gear_cache_key( gear, iterations, seed ):
+    return cache_key(input_profile_text, {'gear': [list(g) for g in gear], 'iterations': iterations, 'seed': seed}, simc_build)
+
+def gear_result_text( dps, error, iterations ):
+    return f"dps,dps_error,iterations\n{dps},{error},{iterations}\n"
+
+def read_gear_result_text( text ):
+    values = text.splitlines()[1].split(",")
+    return float(values[0]), float(values[1]), None if values[2] in ("", "None") else int(values[2])
+
+@timed_section("journal and cache")
+def store_gear_result( gear, iterations, seed, text ):
+    if( use_sim_cache ):
+        cache_put(cache_dir, gear_cache_key(gear, iterations, seed), text)
+    journal_write(journal, {'event': 'gear_result', 'gear': [list(g) for g in gear], 'iterations': iterations, 'seed': seed, 'text': text})
+
+# Mean DPS and its 95% confidence half width, the same error simc writes in the reforge plot
+@timed_section("result parsing")
+def read_json_point( text ):
+    sim = json.loads(text)['sim']
+    dps = sim['players'][0]['collected_data']['dps']
+    confidence = sim.get('options', {}).get('confidence_estimator', 1.96)
+    return dps['mean'], dps['mean_std_dev'] * confidence, dps.get('count')
+
+def seed_options( seed ):
+    if( seed is None ):
+        return []
+    return ["deterministic=1", f"seed={seed}"]
+
+def sim_options( gear ):
+    return tuple(g for g in gear if not g[0].startswith("gear_"))
+
+# One single sim per gear point, or one profileset run for all points that share an iteration count, seed and sim options.
+# Sim options apply to the whole simc process, so they go on its command line instead of into the profilesets
+def gear_point_jobs( requests ):
+    if( use_profilesets ):
+        jobs = []
+        for iterations, seed, options in sorted(set((r[1], r[2], sim_options(r[0])) for r in requests), key=str):
+            batch = [r for r in requests if r[1] == iterations and r[2] == seed and sim_options(r[0]) == options]
+            name = f"{sim_class}_{specilization}_{fight_type_string}_gear_{iterations}_{seed}" + "".join(f"_{option}_{value}" for option, value in options)
+            profileset_file = os.path.join(profile_dir, f"{name}_profilesets.simc")
+            output = output_path(f"{name}_profilesets.json")
+            profilesets = {}
+            with open(profileset_file, "w") as f:
+                for k, (gear, _, _) in enumerate(batch):
+                    profilesets[f"gear_{k}"] = gear
+                    for option, rating in gear:
+                        if( option.startswith("gear_") ):
+                            f.write(f'profileset."gear_{k}"+={option}={rating}\n')
+            command = main_command + [profileset_file] + [f"{option}={value}" for option, value in options] + [f"iterations={iterations}", f"json2={output}", f"profileset_main_threads={max_concurrent_sims}", f"profileset_work_threads={sim_threads}"] + seed_options(seed) + report_options(name)
+            jobs.append({'kind': 'gear_profileset', 'id': f"gear_profileset/{iterations}/{seed}/{len(batch)}" + "".join(f"/{option}={value}" for option, value in options), 'iterations': iterations, 'seed': seed, 'profilesets': profilesets, 'command': command, 'output': output, 'capture': capture_pipes})
+        return jobs
+    jobs = []
+    for gear, iterations, seed in requests:
+        key = gear_cache_key(gear, iterations, seed)
+        name = f"{sim_class}_{specilization}_{fight_type_string}_gear_{key[:16]}"
+        output = output_path(f"{name}.json")
+        command = main_command + [f"{option}={rating}" for option, rating in gear] + [f"iterations={iterations}", f"json2={output}", f"threads={sim_threads}"] + seed_options(seed) + report_options(name)
+        jobs.append({'kind': 'gear', 'id': f"gear/{key[:16]}", 'gear': gear, 'iterations': iterations, 'seed': seed, 'command': command, 'output': output, 'capture': capture_pipes})
+    return jobs
+
+# Result text of a gear point from the run journal or the cache, None if it was never simmed
+def stored_gear_result( gear, iterations, seed ):
+    text = journal_results.get(gear_result_key(gear, iterations, seed))
+    if( text is None and use_sim_cache ):
+        text = cache_get(cache_dir, gear_cache_key(gear, iterations, seed))
+    return text
+
+# Sims every (gear point, iterations, seed) request that has no journal or cache entry yet and returns {request: (dps, error, iterations run)} for all of them.
+# A seed of None uses the seed from the profile, which is random unless common_random_numbers is enabled.
+def run_gear_points( requests ):
+    results = {}
+    missing = []
+    for gear, iterations, seed in dict.fromkeys(requests):
+        text = stored_gear_result(gear, iterations, seed)
+        if( text is None ):
+            missing.append((gear, iterations, seed))
+        else:
+            results[(gear, iterations, seed)] = read_gear_result_text(text)
+    def gear_job_finished( job, return_stat ):
+        journal_write(journal, {'event': 'finished', 'job': job['id'], 'return_code': return_stat})
+        if( return_stat != 0 ):
+            record_job(job, return_stat, None, None)
+            return
+        text = job_output_text(job, keep_raw_csv)
+        if( job['kind'] == 'gear' ):
+            finished = {(job['gear'], job['iterations'], job['seed']): read_json_point(text)}
+        else:
+            sets = json.loads(text)['sim']['profilesets']['results']
+            finished = {(job['profilesets'][r['name']], job['iterations'], job['seed']): (r['mean'], r['mean_error'], r.get('iterations')) for r in sets}
+        record_job(job, return_stat, sum(r[2] or 0 for r in finished.values()), mean_error([r[1] for r in finished.values()]))
+        for request, result in finished.items():
+            store_gear_result(request[0], request[1], request[2], gear_result_text(*result))
+            results[request] = result
+    jobs = gear_point_jobs(missing)
+    run_sim_jobs(jobs, gear_job_finished)
+    return results
 
-for q in primary_matrix_stats:
-    if( os.path.isfile(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_{switch_primary()}_{q}_mod.csv") )):
-        if( query_yes_no(f"Data already exists for {switch_primary()}/{q}, would you like to run the sim anyway?", "yes") ):
-            run_matrix_sim(switch_primary(), q)
+# Sims the given ratings of every stat in one batch and adds each run to results, which holds {stat: {rating: [(dps, error, iterations), ...]}}.
+# exact runs every requested iteration, target_error would stop them once the point reaches the precision it already had
+def sim_sweep_points( results, ratings, iterations, exact=False ):
+    requests = {}
+    for stat, stat_ratings in ratings.items():
+        for r in stat_ratings:
+            point_iterations = iterations[stat][r] if isinstance(iterations, dict) else iterations
+            gear = gear_point({stat: sweep_base_rating(stat) + r})
+            if( exact ):
+                gear = tuple(sorted(gear + (("target_error", 0),)))
+            requests[(stat, r)] = (gear, point_iterations, run_seed(len(results[stat].get(r, [])), stat, r))
+    finished = run_gear_points(list(requests.values()))
+    for (stat, r), request in requests.items():
+        if( request in finished ):
+            results[stat].setdefault(r, []).append(finished[request])
+
+def combined_sweep( results, stat ):
+    x = sorted(results[stat])
+    combined = [combine_runs(results[stat][r]) for r in x]
+    return x, combined
+
+# Runs that are combined at a point have to be independent, so every run after the first has a seed no other run at that point has.
+# With common random numbers the n-th run at every point shares its seed with the n-th run at its neighbours, without them every point gets its own
+def run_seed( run, stat, rating ):
+    if( run == 0 ):
+        return None
+    if( common_random_numbers ):
+        return crn_seed + run
+    return random.Random(f"{crn_seed}/{stat}/{rating}/{run}").randrange(1, 2 ** 31)
+
+# Every stat starts from a coarse grid, then each round sims the midpoints of the intervals where the curve bends, for all stats at once
+def adaptive_sweep_points( results, stats_to_sim, start, stop, iterations ):
+    new_ratings = {stat: coarse_grid(start, stop, plot_step, adaptive_initial_points) for stat in stats_to_sim}
+    for refinement_round in range(adaptive_max_rounds + 1):
+        sim_sweep_points(results, new_ratings, iterations)
+        new_ratings = {}
+        for stat in stats_to_sim:
+            x, combined = combined_sweep(results, stat)
+            new_ratings[stat] = refine_points(x, [c[0] for c in combined], [c[1] for c in combined], plot_step, adaptive_sensitivity)
+        if( refinement_round == adaptive_max_rounds or all(len(r) == 0 for r in new_ratings.values()) ):
+            break
+
+# Adds iterations only to the points next to intervals whose DPS per point is not yet precise enough.
+# Error shrinks with the square root of the iterations, so a point needs (error / target)^2 times the iterations it has, capped at iter.
+# Every extra run is independent and is folded in with combine_runs.
+def fidelity_sweep_points( results, stats_to_sim ):
+    for fidelity_round in range(fidelity_max_rounds):
+        new_ratings = {}
+        new_iterations = {}
+        for stat in stats_to_sim:
+            x, combined = combined_sweep(results, stat)
+            targets = target_errors(x, [c[1] for c in combined], derivative_precision)
+            new_ratings[stat] = []
+            new_iterations[stat] = {}
+            for r, (dps, error, total), target in zip(x, combined, targets):
+                if( target >= error or total >= iter ):
+                    continue
+                new_ratings[stat].append(r)
+                new_iterations[stat][r] = min(iter, math.ceil(total * ( error / target ) ** 2)) - total
+        if( all(len(r) == 0 for r in new_ratings.values()) ):
+            break
+        sim_sweep_points(results, new_ratings, new_iterations, True)
+    for stat in stats_to_sim:
+        x, combined = combined_sweep(results, stat)
+        worst = max(derivative_error(x, [c[1] for c in combined]), default=0)
+        if( worst > derivative_precision ):
+            print(f"{stat} sweep did not reach derivative_precision {derivative_precision}, its widest DPS per point interval is +-{worst:.3f}. Raise fidelity_max_rounds or iter")
+
+# Surface stat names as the rest of the script knows them
+def surface_stat( stat ):
+    return switch_primary() if stat == "primary" else stat
+
+# Rating combinations of the design, in design order, as {stat: rating} of the sampled stats
+def surface_sample_ratings():
+    stats = [s for s in ['haste', 'crit', 'mastery', 'versatility', 'primary'] if s in surface_ranges]
+    design = space_filling_design(surface_design, surface_samples, len(stats), surface_seed)
+    return [{stat: int(round(surface_ranges[stat][0] + u * ( surface_ranges[stat][1] - surface_ranges[stat][0] ))) for stat, u in zip(stats, point)} for point in design]
+
+def run_surface_samples():
+    samples = surface_sample_ratings()
+    requests = [gear_point({surface_stat(stat): rating for stat, rating in ratings.items()}) for ratings in samples]
+    finished = run_gear_points([(gear, surface_iterations, None) for gear in requests])
+    rows = []
+    for sample, (ratings, gear) in enumerate(zip(samples, requests)):
+        result = finished.get((gear, surface_iterations, None))
+        if( result is None ):
+            continue
+        row = {'sample': sample}
+        for stat, column in zip(['haste', 'crit', 'mastery', 'versatility', 'primary'], surface_columns):
+            row[column] = ratings[stat] if stat in ratings else sweep_base_rating(surface_stat(stat))
+        row['dps'], row['dps_error'], row['iterations'] = result
+        rows.append(row)
+    data = pd.DataFrame(rows, columns=['sample'] + surface_columns + ['dps', 'dps_error', 'iterations'])
+    store_surface_points(store, sim_class, specilization, fight_type_string, store_settings, f"{surface_design}/{surface_seed}", data)
+    data.to_csv(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_surface.csv"), index=False)
+    print(f"{len(rows)} of {len(samples)} surface samples stored")
+
+# Ratings of the stat weight gear point, every stat being weighed needs one from stat_weight_point or its base rating
+def stat_weight_ratings():
+    ratings = {surface_stat(stat): rating for stat, rating in stat_weight_point.items()}
+    for stat in stat_weight_stats:
+        ratings.setdefault(surface_stat(stat), sweep_base_rating(surface_stat(stat)))
+    return ratings
+
+# Both sims of every pair of the pattern for one round, as gear point requests
+def stat_weight_pairs( point, stats, signs, weight_round ):
+    pairs = []
+    for k, row in enumerate(signs):
+        seed = stat_weight_seed + weight_round * len(signs) + k
+        pair = []
+        for side in (1, -1):
+            ratings = dict(point)
+            for stat, sign in zip(stats, row):
+                ratings[stat] = point[stat] + side * int(sign) * stat_weight_delta
+            pair.append((gear_point(ratings), stat_weight_iterations, seed))
+        pairs.append(tuple(pair))
+    return pairs
+
+def run_stat_weights():
+    point = stat_weight_ratings()
+    stats = [surface_stat(stat) for stat in stat_weight_stats]
+    for stat in stats:
+        if( point[stat] is None ):
+            sys.exit(f"The rating of {stat} at the stat weight point is unknown, set it in stat_weight_point or enable modify_current_stats")
+        if( point[stat] < stat_weight_delta ):
+            sys.exit(f"{stat} is at {point[stat]} in the stat weight point, below stat_weight_delta, the lower sim of a pair would need a negative rating")
+    signs = perturbation_design(len(stats))
+    rows = []
+    differences = []
+    runs = []
+    gradient, error = None, None
+    for weight_round in range(stat_weight_max_rounds):
+        pairs = stat_weight_pairs(point, stats, signs, weight_round)
+        finished = run_gear_points([request for pair in pairs for request in pair])
+        for row, (up, down) in zip(signs, pairs):
+            if( up in finished and down in finished ):
+                rows.append(row)
+                differences.append(finished[up][0] - finished[down][0])
+                runs += [finished[up], finished[down]]
+        if( len(rows) <= len(stats) ):
+            continue
+        gradient, error = paired_gradient(rows, differences, stat_weight_delta)
+        if( all(e <= stat_weight_precision for e in error) ):
+            break
+    if( gradient is None ):
+        print("Not enough stat weight sims finished to estimate anything")
+        return
+    reference = gradient[stats.index(switch_primary())] if switch_primary() in stats else max(gradient)
+    total_iterations = sum(r[2] or 0 for r in runs)
+    print(f"Stat weights at {', '.join(f'{stat} {rating}' for stat, rating in point.items())} from {len(runs)} sims and {total_iterations} iterations, a sweep of every stat would take {len(stats) * ( plot_points + 1 )} points")
+    for stat, value, value_error in zip(stats, gradient, error):
+        print(f"    {stat:12} {value:8.3f} +-{value_error:.3f} DPS per point, {value / reference:.3f} relative")
+    if( any(e > stat_weight_precision for e in error) ):
+        print(f"    stat_weight_precision of {stat_weight_precision} not reached after {stat_weight_max_rounds} rounds, raise stat_weight_max_rounds or stat_weight_iterations")
+    data = pd.DataFrame({'stat': stats, 'rating': [point[stat] for stat in stats], 'dps_per_point': gradient, 'dps_per_point_error': error, 'relative': gradient / reference})
+    data.to_csv(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_stat_weights.csv"), index=False)
+
+# Stat sweeps made of single sims at explicit ratings, used by adaptive_sampling and multi_fidelity
+def run_point_sweeps( stats_to_sim ):
+    start = 0 if pos else -plot_points * plot_step
+    stop = plot_points * plot_step
+    first_iterations = fidelity_start_iterations if multi_fidelity else iter
+    results = {stat: {} for stat in stats_to_sim}
+    if( adaptive_sampling ):
+        adaptive_sweep_points(results, stats_to_sim, start, stop, first_iterations)
     else:
-        run_matrix_sim(switch_primary(), q)
+        sim_sweep_points(results, {stat: list(range(start, stop + 1, plot_step)) for stat in stats_to_sim}, first_iterations)
+    if( multi_fidelity ):
+        fidelity_sweep_points(results, stats_to_sim)
+    for stat in stats_to_sim:
+        x, combined = combined_sweep(results, stat)
+        total_iterations = sum(c[2] for c in combined)
+        worst = max(derivative_error(x, [c[1] for c in combined]), default=float('nan'))
+        print(f"{stat} sweep used {len(x)} points and {total_iterations} iterations instead of {( stop - start ) // plot_step + 1} points and {( ( stop - start ) // plot_step + 1 ) * iter} iterations, widest DPS per point interval +-{worst:.3f}")
+        data = pd.DataFrame({get_stat_name(stat): x, ' DPS': [c[0] for c in combined], ' DPS-Error': [c[1] for c in combined]})
+        sim_result_finished( stat, None, None, data )
+
+if( not chart_only ):
+    # The journal belongs to one plan, a run with different settings or sweeps starts a new one
+    pipe_dir = tempfile.mkdtemp(prefix="stat_sim_")
+    journal_file = os.path.join(journal_dir, f"{sim_class}_{specilization}_{fight_type_string}.jsonl")
+    plan_matrix = [[m, q] for m, qs in [('haste', haste_matrix_stats), ('crit', crit_matrix_stats), ('mastery', mastery_matrix_stats), ('versatility', vers_matrix_stats), (switch_primary(), primary_matrix_stats)] for q in qs]
+    plan_id = cache_key(input_profile_text, {'stats': sim_stats, 'matrix': plan_matrix, 'matrix_points': matrix_points, 'matrix_step': matrix_step, 'profilesets': use_profilesets, 'adaptive': [adaptive_sampling, adaptive_initial_points, adaptive_max_rounds, adaptive_sensitivity], 'dedupe': dedupe_points, 'fidelity': [multi_fidelity, fidelity_start_iterations, derivative_precision, fidelity_max_rounds], 'surface': [surface_sampling, surface_design, surface_samples, surface_ranges, surface_iterations, surface_seed], 'weights': [stat_weights, stat_weight_point, stat_weight_stats, stat_weight_delta, stat_weight_iterations, stat_weight_precision, stat_weight_max_rounds, stat_weight_seed]}, simc_build)
+    journal_results = None
+    if( resume_sweeps ):
+        journal_results = load_journal(journal_file, plan_id)
+    if( journal_results is not None ):
+        status = journal_status(journal_file)
+        print(f"Resuming from {journal_file}: {status['results']} points already finished, {status['in_flight']} sims were still running and will be run again")
+    journal = open_journal(journal_file, plan_id, journal_results is not None)
+    if( journal_results is None ):
+        journal_results = {}
+
+    # Run the sim
+    next_phase("planning")
+    for i in sim_stats:
+        sim_jobs += stat_sim_jobs(i)
+
+    for q in haste_matrix_stats:
+        sim_jobs += matrix_sim_jobs('haste', q)
+
+    for q in crit_matrix_stats:
+        sim_jobs += matrix_sim_jobs('crit', q)
+
+    for q in mastery_matrix_stats:
+        sim_jobs += matrix_sim_jobs('mastery', q)
+
+    for q in vers_matrix_stats:
+        sim_jobs += matrix_sim_jobs('versatility', q)
 
+    for q in primary_matrix_stats:
+        sim_jobs += matrix_sim_jobs(switch_primary(), q)
+
+    if( len(planned_sweeps) > 0 ):
+        report_planned_sweeps()
+
+    next_phase("sims")
+    post_stage = None
+    if( pipeline_post_processing ):
+        post_stage = start_stage("post-processing")
+
+    # Reused results go through the same stage, so they are processed while the first sims already run
+    if( len(cached_results) > 0 ):
+        print(f"Reusing {len(cached_results)} finished sim results")
+    for stat, matrix_stat, point, text in cached_results:
+        post_process(lambda stat=stat, matrix_stat=matrix_stat, point=point, text=text: sim_result_finished( stat, matrix_stat, point, read_reforge_text(text) ))
+
+    local_workers = []
+    if( execution_backend == "queue" and queue_local_workers > 0 and ( len(sim_jobs) + len(point_sweep_stats) + len(planned_sweeps) > 0 or surface_sampling or stat_weights ) ):
+        local_workers = start_local_workers(queue_dir, queue_local_workers, main_command[0], sim_threads)
+    try:
+        run_sim_jobs(sim_jobs, sim_job_finished)
+        if( len(planned_sweeps) > 0 ):
+            run_planned_sweeps()
+        if( len(point_sweep_stats) > 0 ):
+            run_point_sweeps(point_sweep_stats)
+        if( surface_sampling ):
+            run_surface_samples()
+        if( stat_weights ):
+            run_stat_weights()
+        finish_post_processing()
+    finally:
+        stop_local_workers(local_workers)
+        shutil.rmtree(pipe_dir, ignore_errors=True)
+    if( post_stage is not None ):
+        stop_stage(post_stage)
+    journal_write(journal, {'event': 'complete'})
+    journal.close()
+else:
+    # Stored results of the enabled stats are charted as if they had just been simmed
+    for i in sim_stats:
+        old_data = get_old_data(i)
+        if( old_data is not None ):
+            stat_results[i] = write_extra_data( old_data, i )
+
+next_phase("cache eviction")
+if( use_sim_cache and not chart_only ):
+    cache_evict(cache_dir, cache_max_age_days, cache_max_size_mb)
+
+# Stat results are handled in stat order so the chart traces always come out in the same order
+next_phase("derived data")
+if( fight_series_file != "" ):
+    write_fight_series()
+if( generate_stat_charts ):
+    stat_fig = go.Figure( layout=layout )
+    for i in sim_stats:
+        if( i in stat_results ):
+            add_data( stat_results[i], i, stat_fig )
+
+next_phase("charts")
 if( generate_stat_charts ):
     primary = switch_primary()
     for s in dont_sim_stats:
         match s:
             case "haste":
                 if( graph_haste ):
-                    if( os.path.isfile(os.path.join(data_dir, f"{sim_class}_{specilization}_{s}_{fight_type_string}_mod.csv"))):
-                        add_data( get_old_modified_data(s), s )
-                    else:
-                        if( os.path.isfile(os.path.join(data_dir, f"{sim_class}_{specilization}_{s}_{fight_type_string}.csv"))):
-                            generate_extra_data( get_old_data(s), s )
+                    old_data = get_old_data(s)
+                    if( old_data is not None ):
+                        generate_extra_data( old_data, s, stat_fig )
             case "crit":
                 if( graph_crit ):
-                    if( os.path.isfile(os.path.join(data_dir, f"{sim_class}_{specilization}_{s}_{fight_type_string}_mod.csv"))):
-                        add_data( get_old_modified_data(s), s )
-                    else:
-                        if( os.path.isfile(os.path.join(data_dir, f"{sim_class}_{specilization}_{s}_{fight_type_string}.csv"))):
-                            generate_extra_data( get_old_data(s), s )
+                    old_data = get_old_data(s)
+                    if( old_data is not None ):
+                        generate_extra_data( old_data, s, stat_fig )
             case "mastery":
                 if( graph_mastery ):
-                    if( os.path.isfile(os.path.join(data_dir, f"{sim_class}_{specilization}_{s}_{fight_type_string}_mod.csv"))):
-                        add_data( get_old_modified_data(s), s )
-                    else:
-                        if( os.path.isfile(os.path.join(data_dir, f"{sim_class}_{specilization}_{s}_{fight_type_string}.csv"))):
-                            generate_extra_data( get_old_data(s), s )
+                    old_data = get_old_data(s)
+                    if( old_data is not None ):
+                        generate_extra_data( old_data, s, stat_fig )
             case "versatility":
                 if( graph_vers ):
-                    if( os.path.isfile(os.path.join(data_dir, f"{sim_class}_{specilization}_{s}_{fight_type_string}_mod.csv"))):
-                        add_data( get_old_modified_data(s), s )
-                    else:
-                        if( os.path.isfile(os.path.join(data_dir, f"{sim_class}_{specilization}_{s}_{fight_type_string}.csv"))):
-                            generate_extra_data( get_old_data(s), s )
+                    old_data = get_old_data(s)
+                    if( old_data is not None ):
+                        generate_extra_data( old_data, s, stat_fig )
             case primary:
                 if( graph_primary ):
-                    if( os.path.isfile(os.path.join(data_dir, f"{sim_class}_{specilization}_{s}_{fight_type_string}_mod.csv"))):
-                        add_data( get_old_modified_data(s), s )
-                    else:
-                        if( os.path.isfile(os.path.join(data_dir, f"{sim_class}_{specilization}_{s}_{fight_type_string}.csv"))):
-                            generate_extra_data( get_old_data(s), s )
-    generate_chart()
+                    old_data = get_old_data(s)
+                    if( old_data is not None ):
+                        generate_extra_data( old_data, s, stat_fig )
+    generate_chart( stat_fig )
 
 if( generate_matrix_charts ):
-    for i in haste_matrix_gen_stats:
-        if ( os.path.isfile(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_haste_{i}_mod.csv"))):
-            matrix_sim_finished( "haste", i )
-        if i == str(haste_matrix_gen_stats[-1]):
-            generate_matrix_chart( 'haste' )
-    for i in crit_matrix_gen_stats:
-        if ( os.path.isfile(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_crit_{i}_mod.csv"))):
-            matrix_sim_finished( "crit", i )
-        if i == str(crit_matrix_gen_stats[-1]):
-            generate_matrix_chart( 'crit' )
-    for i in mastery_matrix_gen_stats:
-        if( os.path.isfile(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_mastery_{i}_mod.csv"))):
-            matrix_sim_finished( "mastery", i )
-        if i == str(mastery_matrix_gen_stats[-1]):
-            generate_matrix_chart( 'mastery' )
-    for i in vers_matrix_gen_stats:
-        if( os.path.isfile(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_versatility_{i}_mod.csv"))):
-            matrix_sim_finished( "versatility", i )
-        if i == str(vers_matrix_gen_stats[-1]):
-            generate_matrix_chart( 'versatility' )
-    for i in primary_matrix_gen_stats:
-        if( os.path.isfile(os.path.join(output_dir, f"{sim_class}_{specilization}_{fight_type_string}_{switch_primary()}_{i}_mod.csv"))):
-            matrix_sim_finished( switch_primary(), i )
-        if i == str(primary_matrix_gen_stats[-1]):
-            generate_matrix_chart( switch_primary() )
-                
\ No newline at end of file
+    generate_matrix_chart( "haste", haste_matrix_gen_stats )
+    generate_matrix_chart( "crit", crit_matrix_gen_stats )
+    generate_matrix_chart( "mastery", mastery_matrix_gen_stats )
+    generate_matrix_chart( "versatility", vers_matrix_gen_stats )
+    generate_matrix_chart( switch_primary(), primary_matrix_gen_stats )
+export_chart_batch()
+
+if( record_metrics ):
+    print_summary()
@@ -2,6 +2,9 @@ import plotly.graph_objects as go
 import os
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "sim_stats"))
+from sim_charts import export_charts
+
 # Sets the color of the chart data
 wow_class = "death_knight"
 # Only used for file name outputs, makes it easier to find the output later
@@ -21,6 +24,10 @@ background_color = '#242424'
 font_size = 36
 graph_width = 1150
 graph_height = 1000
+# Files written for the chart, any of "png", "svg" and "html". An unchanged chart is not rendered again
+chart_formats = ["png"]
+# Open the interactive chart in a browser window
+graph_open = True
 
 # Create the variable with a sensable default value so even if the class is not found, it will still work
 class_color = '#C41E3A'
@@ -95,5 +102,7 @@ fig.update_layout(
 )
 
 chart_output_dir = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "chart_output")
-fig.write_image(os.path.join(chart_output_dir,f'{wow_class}_{specilization}_stat_radar.png'))
-fig.show()
\ No newline at end of file
+written, skipped = export_charts([{'path': os.path.join(chart_output_dir, f'{wow_class}_{specilization}_stat_radar'), 'figure': fig.to_json(), 'formats': chart_formats}])
+print(f"{written} chart files written, {skipped} unchanged")
+if( graph_open ):
+  fig.show()
\ No newline at end of file